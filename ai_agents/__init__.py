@@ -0,0 +1,4 @@
+"""Free State Directory AI agents.
+
+Agent modules are imported on demand; nothing heavy happens at package import.
+"""
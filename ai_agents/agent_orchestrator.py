@@ -1,33 +1,101 @@
-import schedule
+import argparse
+import importlib
 import time
-from datetime import datetime, timedelta
-from . import data_scraper, customer_support, social_media_manager
+from datetime import timedelta
+
+import schedule
+
+from . import services
+
+
+def _job(module_name, func_name):
+    """Scheduled job that imports its agent module on first run"""
+    def run():
+        module = importlib.import_module(f"{__package__}.{module_name}")
+        return getattr(module, func_name)()
+    run.__name__ = f"{module_name}.{func_name}"
+    return run
+
+
+def check_health():
+    """One-shot audit: Firestore answers and the support bot is keeping up"""
+    from . import customer_support
+
+    db = services.get_db()
+    list(db.collection('listings').limit(1).stream())
+    print("✅ Firestore reachable")
+    customer_support.check_messages()
+
+
+# Jobs CI can run once by name (--tasks); run_agents() schedules them instead
+TASKS = {
+    'renewals': lambda: check_expirations(),
+    'support': _job('customer_support', 'check_messages'),
+    'social_media': _job('social_media_manager', 'post_content'),
+    'scrape': _job('data_scraper', 'scrape_new_listings'),
+    'revenue_report': _job('revenue', 'report'),
+    'health_audit': lambda: check_health(),
+    'system_health': lambda: check_health(),
+}
+
+
+def run_tasks(names):
+    """Run each named job once; returns the names that failed"""
+    failed = []
+    for name in names:
+        print(f"▶️ Running {name}")
+        try:
+            TASKS[name]()
+        except Exception as e:
+            print(f"❌ {name} failed: {e}")
+            failed.append(name)
+    return failed
+
 
 def run_agents():
     # Daily scraping for new businesses
-    schedule.every().day.at("02:00").do(data_scraper.scrape_new_listings)
-    
+    schedule.every().day.at("02:00").do(_job('data_scraper', 'scrape_new_listings'))
+
     # Renewal reminders (3 days before expiry)
     schedule.every().hour.do(check_expirations)
-    
+
     # Social media posting
-    schedule.every(4).hours.do(social_media_manager.post_content)
-    
+    schedule.every(4).hours.do(_job('social_media_manager', 'post_content'))
+
     # Customer support monitoring
-    schedule.every(30).minutes.do(customer_support.check_messages)
-    
+    schedule.every(30).minutes.do(_job('customer_support', 'check_messages'))
+
     while True:
         schedule.run_pending()
         time.sleep(60)
 
 def check_expirations():
-    # Firestore query for expiring listings
+    from . import customer_support, listing_cache
+
+    # Listings reaching 3 days before expiry within the last hour, so each is
+    # reminded once by this hourly job
+    db = services.get_db()
+    reminder_at = time.time() + timedelta(days=3).total_seconds()
     expiring = db.collection('listings').where(
-        'expiry_date', '==', datetime.now() + timedelta(days=3)
-    ).stream()
-    
-    for listing in expiring:
+        'expiry_date', '>=', reminder_at - 3600
+    ).where('expiry_date', '<', reminder_at).stream()
+
+    # Cached, so the reminders below do not read each listing again
+    for listing in listing_cache.get_cache().prime('listings', expiring):
         customer_support.send_renewal_reminder(listing.id)
 
 if __name__ == "__main__":
-    run_agents()
+    parser = argparse.ArgumentParser(description="Run the agents on a schedule, or named tasks once")
+    parser.add_argument('--tasks', '--task', default=None,
+                        help=f"Comma-separated tasks to run once and exit ({', '.join(TASKS)})")
+    args = parser.parse_args()
+
+    if args.tasks is None:
+        run_agents()
+    else:
+        names = [name.strip() for name in args.tasks.split(',') if name.strip()]
+        unknown = [name for name in names if name not in TASKS]
+        if unknown:
+            parser.error(f"unknown task(s): {', '.join(unknown)}")
+        if run_tasks(names):
+            raise SystemExit(1)
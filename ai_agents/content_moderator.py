@@ -1,10 +1,11 @@
-from google.cloud import vision
-import tensorflow as tf
+from . import metrics, services
 
 class ContentModerator:
     def __init__(self):
+        import tensorflow as tf
+
         self.text_model = tf.keras.models.load_model('models/text_moderation.h5')
-        self.image_client = vision.ImageAnnotatorClient()
+        self.image_client = services.get('vision')
     
     def moderate_text(self, text):
         # Check for banned categories
@@ -13,15 +14,19 @@ class ContentModerator:
             return False
         
         # ML-based scam detection
-        prediction = self.text_model.predict([text])
+        with metrics.span('moderation_predict'):
+            prediction = self.text_model.predict([text])
         return prediction[0][0] < 0.5  # Allow if scam score < 0.5
     
     def moderate_image(self, image_path):
+        from google.cloud import vision
+
         with open(image_path, "rb") as image_file:
             content = image_file.read()
         
         image = vision.Image(content=content)
-        response = self.image_client.safe_search_detection(image=image)
+        with metrics.span('vision_safe_search'):
+            response = self.image_client.safe_search_detection(image=image)
         
         # Block adult/violative content
         if (response.safe_search_annotation.adult > 2 or 
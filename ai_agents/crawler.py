@@ -0,0 +1,248 @@
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import date
+from urllib.parse import urlsplit
+
+from . import metrics
+from .work_queue import WorkQueue
+
+# Checkpointed, sharded directory crawl.
+#
+# The frontier is a WorkQueue keyed by URL, one queue per crawl run, so each
+# page is fetched at most once per run however many workers discover it.
+# Workers claim pages under a lease and ack them only after the page's cards
+# are saved and its next link is queued; a crashed run resumes from the same
+# file and only repeats pages that were in flight. Workers in any number of
+# processes share the queue file and a per-host fetch schedule stored beside
+# it, so politeness holds across all of them rather than per worker.
+#
+# With a RecrawlPlanner (recrawl.py) a run only visits pages that are due,
+# and pages whose cards are unchanged since the last visit are not
+# re-extracted. A full run visits and re-extracts every page but still
+# records each visit, so the planner keeps learning.
+#
+# The frontier, host schedule and planner all live in CRAWL_DB_PATH. The
+# planner is only useful if that file outlives the run: on an ephemeral CI
+# runner, restore and save it between runs (the workflow caches data/crawl
+# for this) or point CRAWL_DB_PATH at persistent storage.
+
+CRAWL_DB_PATH = os.getenv('CRAWL_DB_PATH', 'data/crawl.sqlite3')
+
+# Long enough to fetch a page and save its cards; expired leases are re-crawled
+LEASE_SECONDS = 300
+
+HOSTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawl_hosts (
+    host          TEXT PRIMARY KEY,
+    next_fetch_at REAL NOT NULL
+);
+"""
+
+
+class HostThrottle:
+    """Per-host fetch schedule shared by every worker using the same file"""
+
+    def __init__(self, path=CRAWL_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn().executescript(HOSTS_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def reserve(self, host, interval):
+        """Book the next free fetch slot for host; returns seconds until it"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT next_fetch_at FROM crawl_hosts WHERE host = ?', (host,)).fetchone()
+            slot = max(now, row[0] if row else 0)
+            conn.execute('INSERT OR REPLACE INTO crawl_hosts (host, next_fetch_at) VALUES (?, ?)',
+                         (host, slot + interval))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return slot - now
+
+    def wait(self, url, interval):
+        delay = self.reserve(urlsplit(url).netloc, interval)
+        if delay > 0:
+            with metrics.span('crawl_politeness_wait'):
+                time.sleep(delay)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def default_run_id():
+    """One frontier per night; restarting the same night resumes it"""
+    return date.today().isoformat()
+
+
+def get_frontier(run_id=None, path=CRAWL_DB_PATH):
+    return WorkQueue(path, name=f"crawl:{run_id or default_run_id()}", lease_seconds=LEASE_SECONDS)
+
+
+def seed(frontier, base_urls, regions, planner=None):
+    """Queue each region's first page (and, when planning, every due page)
+
+    Pages already in the frontier are left alone.
+    """
+    pages = [(base_urls[region], region) for region in regions if region in base_urls]
+    if planner is not None:
+        pages = [(url, region) for url, region in pages if planner.is_due(url)]
+        pages += [(url, region) for url, region in planner.due_pages() if region in regions]
+    return frontier.put_many([(url, {'region': region, 'url': url}) for url, region in pages])
+
+
+def crawl_worker(frontier, throttle, scraper, planner=None, owner=None, idle_sleep=1.0, full=False):
+    """Claim and crawl pages until the frontier is drained; returns pages crawled
+
+    full=True follows and re-extracts every page, still recording visits.
+    """
+    from .data_scraper import TransientFetchError
+
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    crawled = 0
+    while True:
+        claimed = frontier.claim(1, owner=owner)
+        if not claimed:
+            counts = frontier.stats()
+            if not counts['pending'] and not counts['leased']:
+                return crawled
+            # Other workers hold the rest, or it is backing off after a failure
+            time.sleep(idle_sleep)
+            continue
+
+        url, item = claimed[0]
+        try:
+            throttle.wait(url, random.uniform(*scraper.delay_range))
+            if planner is None:
+                next_url = scraper.crawl_page(url)
+            else:
+                next_url = _revisit_page(scraper, planner, url, item['region'], full)
+        except TransientFetchError as e:
+            frontier.fail([url], error=str(e), backoff=30)
+            metrics.counter('crawl_pages_total', "Frontier pages processed").inc(status='retry')
+            continue
+        except Exception as e:
+            print(f"Crawl error on {url}: {e}")
+            frontier.fail([url], error=str(e), backoff=30)
+            metrics.counter('crawl_pages_total', "Frontier pages processed").inc(status='error')
+            continue
+
+        # Queue the next page before acking, so a crash here repeats this page
+        # instead of losing the rest of the region
+        if next_url and (planner is None or full or planner.is_due(next_url)):
+            frontier.put(next_url, {'region': item['region'], 'url': next_url})
+        frontier.ack([url])
+        metrics.counter('crawl_pages_total', "Frontier pages processed").inc(status='done')
+        crawled += 1
+
+
+def _revisit_page(scraper, planner, url, region, full=False):
+    """Fetch a page, extract its cards if they changed (or always, if full), and reschedule it"""
+    from .recrawl import fingerprint
+
+    page = scraper.fetch_page(url)
+    cards, next_url = page if page is not None else ([], None)
+    page_fingerprint = fingerprint(cards)
+    if full or planner.has_changed(url, page_fingerprint):
+        scraper.save_cards(cards, url)
+    else:
+        metrics.counter('crawl_unchanged_pages_total', "Pages skipped as unchanged").inc()
+    planner.record_visit(url, region, page_fingerprint, next_url)
+    return next_url
+
+
+def _worker_main(path, run_id, base_urls, full):
+    from .data_scraper import BusinessScraper
+    from .recrawl import RecrawlPlanner
+
+    frontier = get_frontier(run_id, path)
+    throttle = HostThrottle(path)
+    planner = RecrawlPlanner(path)
+    try:
+        crawled = crawl_worker(frontier, throttle, BusinessScraper(base_urls=base_urls), planner, full=full)
+    finally:
+        frontier.close()
+        throttle.close()
+        planner.close()
+    print(f"Worker {os.getpid()} crawled {crawled} pages")
+
+
+def crawl(workers=1, run_id=None, regions=None, base_urls=None, path=CRAWL_DB_PATH, seed_frontier=True,
+          full=False):
+    """Seed the frontier and crawl it with `workers` local processes
+
+    More workers can join from other shells (`--no-seed`) while it runs.
+    full=True visits and re-extracts every page regardless of schedule.
+    """
+    from .data_scraper import BASE_URLS, REGIONS
+    from .recrawl import RecrawlPlanner
+
+    run_id = run_id or default_run_id()
+    base_urls = base_urls or BASE_URLS
+    frontier = get_frontier(run_id, path)
+    if seed_frontier:
+        planner = None if full else RecrawlPlanner(path)
+        seed(frontier, base_urls, regions or REGIONS, planner)
+        if planner is not None:
+            planner.close()
+
+    if workers <= 1:
+        _worker_main(path, run_id, base_urls, full)
+    else:
+        # spawn, not fork: children must not inherit gRPC/Firebase state
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=_worker_main, args=(path, run_id, base_urls, full))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+    counts = frontier.stats()
+    frontier.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checkpointed directory crawl")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes on this host")
+    parser.add_argument('--run', default=None, help="Crawl run id (default: today's date)")
+    parser.add_argument('--path', default=CRAWL_DB_PATH)
+    parser.add_argument('--no-seed', action='store_true', help="Join an existing run without seeding it")
+    parser.add_argument('--status', action='store_true', help="Print the frontier counts and exit")
+    parser.add_argument('--full', action='store_true', help="Visit and re-extract every page (visits are still recorded)")
+    args = parser.parse_args()
+
+    if args.status:
+        from .recrawl import RecrawlPlanner
+
+        print(get_frontier(args.run, args.path).stats())
+        print(RecrawlPlanner(args.path).stats())
+    else:
+        counts = crawl(args.workers, args.run, path=args.path, seed_frontier=not args.no_seed,
+                       full=args.full)
+        print(f"✅ Crawl {args.run or default_run_id()}: {counts['done']} pages done, "
+              f"{counts['dead']} failed, {counts['pending'] + counts['leased']} left")
@@ -3,45 +3,67 @@ import re
 import json
 import time
 import random
-import requests
-import firebase_admin
-from firebase_admin import firestore, credentials
-from telegram import Update, Bot
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext
-from rasa.core.agent import Agent
-from rasa.shared.constants import DEFAULT_MODELS_PATH
-
-# Initialize Firebase
-cred = credentials.Certificate('firebase-key.json')
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+from typing import TYPE_CHECKING
+
+from . import listing_cache, metrics, nlu_pool, search_index, services
+
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import CallbackContext
+
+# Firestore is resolved on first use, not at import
+db = services.LazyService('firestore')
+
+# Messages that read like a directory lookup rather than a support question
+SEARCH_PREFIXES = ('find', 'search', 'looking for', 'where can i find', 'need a', 'need an')
+
+# Unanswered Telegram updates that check_messages reports as a problem
+PENDING_MESSAGES_ALERT = 50
 
 class CustomerSupportAgent:
     def __init__(self):
-        # Load Rasa model
-        self.agent = Agent.load(os.path.join(DEFAULT_MODELS_PATH, "rasa_model.tar.gz"))
+        # Heavy dependencies are only needed once the bot actually starts
+        from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
+
+        # Rasa models load in worker processes, off the polling thread; a model
+        # that will not load stops the bot here rather than hanging it
+        self.nlu = nlu_pool.NLUPool().start(timeout=nlu_pool.START_TIMEOUT)
         
-        # Initialize Telegram bot
+        # Initialize Telegram bot with enough handler threads to keep every NLU worker busy
         self.telegram_token = os.getenv('TELEGRAM_BOT_TOKEN')
-        self.updater = Updater(token=self.telegram_token, use_context=True)
+        self.updater = Updater(token=self.telegram_token, use_context=True, workers=self.nlu.size * 4)
         self.dispatcher = self.updater.dispatcher
         
-        # Register handlers
-        self.dispatcher.add_handler(MessageHandler(Filters.text, self.handle_message))
+        # Register handlers; messages run async so a slow reply never holds up the next user
+        self.dispatcher.add_handler(MessageHandler(Filters.text, self.handle_message, run_async=True))
         self.dispatcher.add_handler(CommandHandler('renew', self.handle_renewal))
         self.dispatcher.add_handler(CommandHandler('help', self.handle_help))
+        self.dispatcher.add_handler(CommandHandler('search', self.handle_search_command))
+
+        # Local listing index, kept current by a Firestore listener
+        self.search_index = search_index.get_index()
+        self.search_watch = search_index.attach_listener(self.search_index, db)
+
+        # The bot runs for days, so listening to its cached documents pays off
+        listing_cache.get_cache().watch()
         
         # Start polling in background
         self.updater.start_polling()
         
         print("🤖 Customer Support Agent Initialized")
 
-    async def handle_rasa_message(self, user_id, message):
+    def handle_rasa_message(self, user_id, message):
         """Process messages with Rasa NLP"""
-        responses = await self.agent.handle_text(message, sender_id=user_id)
+        try:
+            responses = self.nlu.ask(user_id, message)
+        except nlu_pool.Overloaded:
+            return "I'm answering a lot of messages right now. Please try again in a minute."
+        except Exception as e:
+            print(f"NLU error: {str(e)}")
+            responses = None
         return responses[0]['text'] if responses else "I didn't understand that."
 
-    def handle_message(self, update: Update, context: CallbackContext):
+    def handle_message(self, update: 'Update', context: 'CallbackContext'):
         """Handle incoming messages"""
         user_id = str(update.message.from_user.id)
         message = update.message.text
@@ -49,24 +71,45 @@ class CustomerSupportAgent:
         # Check if it's a command-like message
         if message.lower().startswith(('renew', 'payment', 'boost')):
             response = self.handle_renewal_request(user_id, message)
+        elif message.lower().startswith(SEARCH_PREFIXES):
+            # Answer lookups from the local index; fall back to Rasa on no hits
+            response = self.search_listings(message) or self.handle_rasa_message(user_id, message)
         else:
             # Process with Rasa
-            response = asyncio.run(self.handle_rasa_message(user_id, message))
+            response = self.handle_rasa_message(user_id, message)
         
         update.message.reply_text(response)
 
-    def handle_renewal(self, update: Update, context: CallbackContext):
+    def handle_renewal(self, update: 'Update', context: 'CallbackContext'):
         """Handle /renew command"""
         user_id = str(update.message.from_user.id)
         response = self.handle_renewal_request(user_id)
         update.message.reply_text(response)
 
-    def handle_help(self, update: Update, context: CallbackContext):
+    def handle_search_command(self, update: 'Update', context: 'CallbackContext'):
+        """Handle /search command"""
+        query = " ".join(context.args)
+        if not query:
+            update.message.reply_text("Usage: /search plumber in Welkom")
+            return
+        update.message.reply_text(self.search_listings(query) or f"No listings found for \"{query}\".")
+
+    def search_listings(self, query, limit=5):
+        """Format the best matching listings, or None when nothing matches"""
+        with metrics.span('search_listings'):
+            hits = self.search_index.search(query, limit=limit)
+        if not hits:
+            return None
+        lines = [f"- {hit['business_name']} ({hit['category']}, {hit['town']})" for hit in hits]
+        return "Here's what I found:\n" + "\n".join(lines)
+
+    def handle_help(self, update: 'Update', context: 'CallbackContext'):
         """Handle /help command"""
         help_text = (
             "🌟 Free State Directory Support 🌟\n\n"
             "Commands:\n"
             "/renew - Renew your listing\n"
+            "/search - Find a business, e.g. /search plumber in Welkom\n"
             "/help - Show this help\n\n"
             "Ask me about:\n"
             "- Listing status\n"
@@ -80,16 +123,16 @@ class CustomerSupportAgent:
         """Process listing renewal requests"""
         # Fetch user's active listings
         listings_ref = db.collection('listings').where('owner_id', '==', user_id)
-        listings = listings_ref.stream()
+        # Cached so the payment links below are not read again
+        listings = listing_cache.get_cache().prime('listings', listings_ref.stream())
         
         expiring_listings = []
         for listing in listings:
-            listing_data = listing.to_dict()
-            if listing_data.get('expiry_date') and listing_data['expiry_date'] < time.time() + 259200:  # 3 days
+            if listing.get('expiry_date') and listing['expiry_date'] < time.time() + 259200:  # 3 days
                 expiring_listings.append({
                     'id': listing.id,
-                    'name': listing_data.get('business_name', 'Unknown'),
-                    'expiry': listing_data['expiry_date']
+                    'name': listing.get('business_name', 'Unknown'),
+                    'expiry': listing['expiry_date']
                 })
         
         if not expiring_listings:
@@ -106,8 +149,7 @@ class CustomerSupportAgent:
     def generate_payment_link(self, user_id, listing_id):
         """Generate PayFast payment link"""
         # Get listing details
-        listing_ref = db.collection('listings').document(listing_id)
-        listing = listing_ref.get().to_dict()
+        listing = listing_cache.get_cache().get('listings', listing_id)
         
         # Determine price based on type
         if listing.get('tier') == 'large_business':
@@ -134,51 +176,11 @@ class CustomerSupportAgent:
 
     def send_renewal_reminder(self):
         """Send renewal reminders to users with expiring listings"""
-        now = time.time()
-        three_days = 259200  # 3 days in seconds
-        
-        # Query listings expiring in 3 days
-        expiring_ref = db.collection('listings').where('expiry_date', '>', now).where('expiry_date', '<', now + three_days)
-        listings = expiring_ref.stream()
-        
-        for listing in listings:
-            listing_data = listing.to_dict()
-            user_ref = db.collection('users').document(listing_data['owner_id'])
-            user = user_ref.get().to_dict()
-            
-            if user.get('telegram_id'):
-                # Send Telegram message
-                bot = Bot(token=self.telegram_token)
-                message = (
-                    f"⏰ Your listing for {listing_data['business_name']} is expiring soon!\n"
-                    f"Renew now to maintain your visibility: /renew"
-                )
-                bot.send_message(chat_id=user['telegram_id'], text=message)
-            
-            if user.get('email'):
-                # Send email
-                self.send_email(
-                    user['email'],
-                    "Your Free State Directory Listing is Expiring",
-                    f"Renew your listing for {listing_data['business_name']}: https://freestatedirectory.co.za/renew/{listing.id}"
-                )
+        send_renewal_reminder(telegram_token=self.telegram_token)
 
     def send_email(self, email, subject, body):
         """Send email via SendGrid"""
-        from sendgrid import SendGridAPIClient
-        from sendgrid.helpers.mail import Mail
-        
-        message = Mail(
-            from_email='support@freestatedirectory.co.za',
-            to_emails=email,
-            subject=subject,
-            html_content=body)
-        
-        try:
-            sg = SendGridAPIClient(os.getenv('SENDGRID_API_KEY'))
-            sg.send(message)
-        except Exception as e:
-            print(f"Email error: {str(e)}")
+        send_email(email, subject, body)
 
     def run(self):
         """Main run loop"""
@@ -191,6 +193,85 @@ class CustomerSupportAgent:
                 print(f"Support agent error: {str(e)}")
                 time.sleep(60)
 
+# Scheduled by agent_orchestrator, which runs without starting the bot
+
+def send_renewal_reminder(listing_id=None, telegram_token=None):
+    """Remind owners to renew: one listing, or every listing expiring within 3 days"""
+    cache = listing_cache.get_cache()
+    if listing_id:
+        listings = [listing for listing in [cache.get('listings', listing_id)] if listing is not None]
+    else:
+        now = time.time()
+        three_days = 259200  # 3 days in seconds
+
+        # Query listings expiring in 3 days
+        expiring_ref = db.collection('listings').where('expiry_date', '>', now).where('expiry_date', '<', now + three_days)
+        listings = cache.prime('listings', expiring_ref.stream())
+    # Owners come from the shared cache, missing ones in batched reads
+    owners = cache.get_many('users', [listing['owner_id'] for listing in listings])
+    bot = None
+
+    for listing in listings:
+        user = owners[listing['owner_id']]
+        if user is None:
+            continue
+
+        if user.get('telegram_id'):
+            if bot is None:
+                from telegram import Bot
+                bot = Bot(token=telegram_token or os.getenv('TELEGRAM_BOT_TOKEN'))
+
+            # Send Telegram message
+            message = (
+                f"⏰ Your listing for {listing['business_name']} is expiring soon!\n"
+                f"Renew now to maintain your visibility: /renew"
+            )
+            with metrics.span('send_telegram'):
+                bot.send_message(chat_id=user['telegram_id'], text=message)
+
+        if user.get('email'):
+            # Send email
+            send_email(
+                user['email'],
+                "Your Free State Directory Listing is Expiring",
+                f"Renew your listing for {listing['business_name']}: https://freestatedirectory.co.za/renew/{listing.id}"
+            )
+
+@metrics.timed('send_email')
+def send_email(email, subject, body):
+    """Send email via SendGrid"""
+    from sendgrid import SendGridAPIClient
+    from sendgrid.helpers.mail import Mail
+
+    message = Mail(
+        from_email='support@freestatedirectory.co.za',
+        to_emails=email,
+        subject=subject,
+        html_content=body)
+
+    try:
+        sg = SendGridAPIClient(os.getenv('SENDGRID_API_KEY'))
+        sg.send(message)
+        metrics.counter('emails_total', "Emails sent via SendGrid").inc(status='sent')
+    except Exception as e:
+        metrics.counter('emails_total', "Emails sent via SendGrid").inc(status='error')
+        print(f"Email error: {str(e)}")
+
+def check_messages():
+    """Support monitoring: Telegram messages still waiting for the bot
+
+    The bot polls from its own process, so a growing backlog means it is down
+    or falling behind.
+    """
+    from telegram import Bot
+
+    pending = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN')).get_webhook_info().pending_update_count
+    if pending >= PENDING_MESSAGES_ALERT:
+        print(f"⚠️ {pending} support messages waiting; is the support bot running?")
+    else:
+        print(f"📬 {pending} support messages waiting")
+    return pending
+
 if __name__ == "__main__":
     agent = CustomerSupportAgent()
     agent.run()
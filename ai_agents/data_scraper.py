@@ -1,62 +1,126 @@
+import argparse
 import requests
 from bs4 import BeautifulSoup
 import re
 import json
 import time
 import random
+import hashlib
+from urllib.parse import urlsplit
 from urllib.robotparser import RobotFileParser
-from firebase_admin import firestore, credentials
 import os
 
-# Initialize Firestore
-cred = credentials.Certificate('firebase-key.json')
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+from . import metrics, services
+
+# Firestore is resolved on first use, not at import
+db = services.LazyService('firestore')
+
+# District municipalities covered by the nightly crawl
+REGIONS = ['mangaung', 'xhariep', 'lejweleputswa', 'thabo_mofutsanyana', 'fezile_dabi']
+
+# Base URLs for different regions (example)
+BASE_URLS = {
+    'mangaung': 'https://example.com/mangaung-businesses',
+    'xhariep': 'https://example.com/xhariep-businesses'
+}
 
 # Polite scraping with rate limiting
 HEADERS = {
     'User-Agent': 'FreeStateDirectoryBot/1.0 (+https://freestatedirectory.co.za/bot)'
 }
 
+# Statuses worth retrying later rather than skipping
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class TransientFetchError(IOError):
+    pass
+
 class BusinessScraper:
-    def __init__(self):
+    # Seconds to wait before each fetch (min, max)
+    delay_range = (1, 3)
+
+    def __init__(self, base_urls=None):
+        self.base_urls = base_urls or BASE_URLS
         self.seen_urls = set()
         self.business_data = []
+        self._robots = {}
         
     def scrape_region(self, region):
-        # Base URLs for different regions (example)
-        base_urls = {
-            'mangaung': 'https://example.com/mangaung-businesses',
-            'xhariep': 'https://example.com/xhariep-businesses'
-        }
-        
-        if region not in base_urls:
+        if region not in self.base_urls:
             print(f"Region {region} not configured for scraping.")
             return
             
-        self._scrape_page(base_urls[region])
+        self._scrape_page(self.base_urls[region])
         
     def _scrape_page(self, url):
-        # Check robots.txt
-        rp = RobotFileParser()
-        rp.set_url(f"{url}/robots.txt")
-        rp.read()
-        
-        if not rp.can_fetch(HEADERS['User-Agent'], url):
-            print(f"Blocked by robots.txt: {url}")
+        time.sleep(random.uniform(*self.delay_range))  # Be polite
+        try:
+            next_url = self.crawl_page(url)
+        except TransientFetchError as e:
+            print(f"Failed to fetch {url}: {e}")
             return
+
+        # Pagination handling (example)
+        if next_url and next_url not in self.seen_urls:
+            self.seen_urls.add(next_url)
+            self._scrape_page(next_url)
+
+    def crawl_page(self, url):
+        """Fetch one page and save its cards; returns the next page URL, if any
+
+        Raises TransientFetchError when the fetch is worth retrying later.
+        """
+        page = self.fetch_page(url)
+        if page is None:
+            return None
+        cards, next_url = page
+        self.save_cards(cards, url)
+        return next_url
+
+    def fetch_page(self, url):
+        """Fetch and parse one page; returns (cards, next_url) or None if skipped"""
+        soup = self._fetch(url)
+        if soup is None:
+            return None
+        return soup.select('.business-card'), self._next_url(soup, url)
+
+    def _allowed(self, url):
+        # robots.txt is read once per host, not once per page
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        rp = self._robots.get(origin)
+        if rp is None:
+            rp = RobotFileParser()
+            rp.set_url(f"{origin}/robots.txt")
+            with metrics.span('scrape_robots'):
+                rp.read()
+            self._robots[origin] = rp
+        return rp.can_fetch(HEADERS['User-Agent'], url)
+
+    def _fetch(self, url):
+        if not self._allowed(url):
+            print(f"Blocked by robots.txt: {url}")
+            return None
             
         # Fetch page
-        time.sleep(random.uniform(1, 3))  # Be polite
-        response = requests.get(url, headers=HEADERS)
+        with metrics.span('scrape_fetch'):
+            response = requests.get(url, headers=HEADERS, timeout=(10, 60))
+        metrics.counter('scrape_pages_total', "Directory pages fetched").inc(status=response.status_code)
+        if response.status_code in RETRY_STATUSES:
+            raise TransientFetchError(f"HTTP {response.status_code}")
         if response.status_code != 200:
             print(f"Failed to fetch {url}: {response.status_code}")
-            return
+            return None
             
-        soup = BeautifulSoup(response.text, 'html.parser')
+        with metrics.span('scrape_parse'):
+            return BeautifulSoup(response.text, 'html.parser')
+
+    def save_cards(self, cards, url):
+        """Store unseen businesses from a page's cards and invite them to claim"""
+        metrics.counter('scrape_cards_total', "Business cards extracted").inc(len(cards))
         
         # Example: Extract business cards
-        for card in soup.select('.business-card'):
+        for card in cards:
             name = card.select_one('.name').text.strip()
             category = card.select_one('.category').text.strip()
             phone = card.select_one('.phone').text.strip() if card.select_one('.phone') else ''
@@ -68,26 +132,29 @@ class BusinessScraper:
             
             # Save to Firestore if not exists
             doc_ref = db.collection('unclaimed_listings').document(business_id)
-            if not doc_ref.get().exists:
-                doc_ref.set({
-                    'name': name,
-                    'category': category,
-                    'phone': phone,
-                    'email': email,
-                    'address': address,
-                    'source_url': url,
-                    'scraped_at': firestore.SERVER_TIMESTAMP
-                })
+            with metrics.span('firestore_get', collection='unclaimed_listings'):
+                exists = doc_ref.get().exists
+            if not exists:
+                from firebase_admin import firestore
+
+                with metrics.span('firestore_set', collection='unclaimed_listings'):
+                    doc_ref.set({
+                        'name': name,
+                        'category': category,
+                        'phone': phone,
+                        'email': email,
+                        'address': address,
+                        'source_url': url,
+                        'scraped_at': firestore.SERVER_TIMESTAMP
+                    })
                 # Send claim invite
                 self._send_claim_invite(name, email, phone)
-                
-        # Pagination handling (example)
+
+    def _next_url(self, soup, url):
         next_page = soup.select_one('a.next')
         if next_page and next_page.get('href'):
-            next_url = requests.compat.urljoin(url, next_page['href'])
-            if next_url not in self.seen_urls:
-                self.seen_urls.add(next_url)
-                self._scrape_page(next_url)
+            return requests.compat.urljoin(url, next_page['href'])
+        return None
                 
     def _send_claim_invite(self, business_name, email, phone):
         # Send email invite
@@ -111,8 +178,35 @@ class BusinessScraper:
         print(f"Email to {email}: {subject} - {body}")
         # Implement actual email sending in production
 
+def scrape_new_listings(workers=None, run_id=None, full_scan=False):
+    """Crawl every configured region for new businesses
+
+    Runs on the checkpointed frontier (see crawler.py), so restarting on the
+    same day resumes the crawl instead of starting it over. Only pages due
+    for a revisit are fetched unless full_scan is set; either way every
+    visit updates the re-crawl schedule (see recrawl.py).
+    """
+    from . import crawler
+
+    workers = workers or int(os.getenv('CRAWL_WORKERS', '1'))
+    counts = crawler.crawl(workers, run_id, full=full_scan)
+    print(f"✅ Scraped {counts['done']} pages ({counts['dead']} failed)")
+    return counts
+
 if __name__ == "__main__":
-    scraper = BusinessScraper()
-    regions = ['mangaung', 'xhariep', 'lejweleputswa', 'thabo_mofutsanyana', 'fezile_dabi']
-    for region in regions:
-        scraper.scrape_region(region)
+    parser = argparse.ArgumentParser(description="Scrape directories for new businesses")
+    parser.add_argument('--workers', type=int, default=None, help="Crawl worker processes")
+    parser.add_argument('--full-scan', action='store_true',
+                        help="Fetch every page, ignoring the re-crawl schedule")
+    parser.add_argument('--run', default=None,
+                        help="Crawl run id to start or resume (default: today's date, '-full' for full scans)")
+    args = parser.parse_args()
+
+    # A full scan gets its own run so it does not resume today's planned crawl,
+    # but re-running it the same day still resumes where it stopped
+    run_id = args.run
+    if run_id is None and args.full_scan:
+        from .crawler import default_run_id
+
+        run_id = f"{default_run_id()}-full"
+    scrape_new_listings(args.workers, run_id, args.full_scan)
@@ -0,0 +1,190 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Responsive image build stage.
+#
+# Turns the full-size JPEGs from scripts/download_images.py and
+# image_generator.generate_image into several widths in JPEG, WebP and (when
+# Pillow supports it) AVIF, watermarks each variant, and writes a manifest the
+# frontend reads to build srcset attributes. Sources whose content hash and
+# recipe are unchanged are skipped, so adding one town only builds that town.
+
+OUTPUT_DIR = "frontend/public/assets/responsive"
+
+# (group, source directory, watermark variants?)
+SOURCES = [
+    ("towns", "frontend/src/assets/towns", True),
+    ("categories", "frontend/src/assets/categories", True),
+    # generate_image already stamps these at full size
+    ("generated", "frontend/public/assets", False),
+]
+
+WIDTHS = (320, 640, 1024, 1600)
+QUALITY = {"jpg": 82, "webp": 80, "avif": 55}
+SOURCE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+PIL_FORMATS = {"jpg": "JPEG", "webp": "WEBP", "avif": "AVIF"}
+
+
+def available_formats():
+    """Output formats this Pillow build can encode"""
+    from PIL import features
+
+    formats = ["jpg"]
+    if features.check("webp"):
+        formats.append("webp")
+    try:
+        avif = features.check("avif")
+    except ValueError:
+        avif = False
+    if not avif:
+        try:
+            import pillow_avif  # noqa: F401  (registers the AVIF plugin)
+            avif = True
+        except ImportError:
+            pass
+    if avif:
+        formats.append("avif")
+    return formats
+
+
+def recipe_hash(formats):
+    """Changes whenever the variant settings change, forcing a rebuild"""
+    recipe = {"widths": WIDTHS, "formats": formats, "quality": QUALITY, "version": 1}
+    return hashlib.sha256(json.dumps(recipe, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_sources():
+    """Yield (key, group, path, watermark) for every source image"""
+    for group, directory, watermark in SOURCES:
+        if not os.path.isdir(directory):
+            continue
+        # Top level only: OUTPUT_DIR lives under frontend/public/assets
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path) and filename.lower().endswith(SOURCE_EXTENSIONS):
+                yield f"{group}/{os.path.splitext(filename)[0]}", group, path, watermark
+
+
+def build_variants(key, path, watermark, formats, output_dir=OUTPUT_DIR):
+    """Resize, watermark and encode one source; runs in a worker process"""
+    from PIL import Image
+
+    from .image_generator import add_watermark
+
+    with Image.open(path) as source:
+        source = source.convert("RGB")
+        width, height = source.size
+        # Never upscale; always offer at least the original width
+        widths = sorted({w for w in WIDTHS if w < width} | {min(width, WIDTHS[-1])})
+
+        variants = []
+        os.makedirs(os.path.join(output_dir, os.path.dirname(key)), exist_ok=True)
+        for target_width in widths:
+            target_height = round(height * target_width / width)
+            image = source.resize((target_width, target_height), Image.LANCZOS)
+            if watermark:
+                image = add_watermark(image)
+            for fmt in formats:
+                relative = f"{key}-{target_width}.{fmt}"
+                image.save(os.path.join(output_dir, relative), PIL_FORMATS[fmt],
+                           quality=QUALITY[fmt], optimize=fmt == "jpg")
+                variants.append({"width": target_width, "height": target_height,
+                                 "format": fmt, "path": relative})
+
+    return {"width": width, "height": height, "variants": variants}
+
+
+def _remove_variants(entry, output_dir):
+    for variant in entry.get("variants", []):
+        try:
+            os.remove(os.path.join(output_dir, variant["path"]))
+        except OSError:
+            pass
+
+
+def build(workers=None, force=False, output_dir=OUTPUT_DIR):
+    """Bring derivatives and manifest up to date; returns (built, skipped, removed)"""
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    formats = available_formats()
+    recipe = recipe_hash(formats)
+
+    todo = []
+    current = {}
+    for key, group, path, watermark in find_sources():
+        digest = sha256_file(path)
+        entry = manifest.get(key)
+        up_to_date = (
+            not force and entry
+            and entry["sha256"] == digest and entry["recipe"] == recipe
+            and all(os.path.exists(os.path.join(output_dir, v["path"])) for v in entry["variants"])
+        )
+        if up_to_date:
+            current[key] = entry
+        else:
+            todo.append((key, group, path, watermark, digest))
+
+    built = 0
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(build_variants, key, path, watermark, formats, output_dir): (key, group, path, digest)
+                for key, group, path, watermark, digest in todo
+            }
+            for future in as_completed(futures):
+                key, group, path, digest = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Failed to build variants for {path}: {e}")
+                    if key in manifest:
+                        current[key] = manifest[key]
+                    continue
+                if key in manifest:
+                    # Drop variants the new recipe no longer produces
+                    kept = {v["path"] for v in result["variants"]}
+                    _remove_variants({"variants": [v for v in manifest[key]["variants"] if v["path"] not in kept]},
+                                     output_dir)
+                current[key] = {"group": group, "source": path, "sha256": digest, "recipe": recipe, **result}
+                built += 1
+                print(f"Built {len(result['variants'])} variants for {path}")
+
+    # Sources that disappeared take their variants with them
+    removed = [key for key in manifest if key not in current]
+    for key in removed:
+        _remove_variants(manifest[key], output_dir)
+
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(dict(sorted(current.items())), f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+    return built, len(current) - built, len(removed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build responsive image derivatives")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="Rebuild every source")
+    args = parser.parse_args()
+
+    built, skipped, removed = build(workers=args.workers, force=args.force)
+    print(f"✅ {built} built, {skipped} unchanged, {removed} removed")
@@ -1,29 +1,65 @@
-from diffusers import StableDiffusionPipeline
-import torch
-import requests
-from io import BytesIO
+import argparse
+import functools
+import os
+import threading
+
+MODEL_ID = "stabilityai/stable-diffusion-2-1"
+
+_pipe = None
+_pipe_lock = threading.Lock()
+
+def get_pipeline():
+    """Load the diffusion pipeline once, on first use"""
+    global _pipe
+    if _pipe is None:
+        with _pipe_lock:
+            if _pipe is None:
+                from diffusers import StableDiffusionPipeline
+                import torch
+
+                pipe = StableDiffusionPipeline.from_pretrained(MODEL_ID, torch_dtype=torch.float16)
+                _pipe = pipe.to("cuda" if torch.cuda.is_available() else "cpu")
+    return _pipe
 
 def generate_image(prompt, output_path):
-    model_id = "stabilityai/stable-diffusion-2-1"
-    pipe = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=torch.float16)
-    pipe = pipe.to("cuda" if torch.cuda.is_available() else "cpu")
-    
+    pipe = get_pipeline()
+
     image = pipe(prompt, height=512, width=768).images[0]
-    
+
     # Add anti-theft watermark
     image = add_watermark(image)
-    
+
     image.save(output_path)
     return output_path
 
-def add_watermark(img):
-    # Simplified watermark implementation
+@functools.lru_cache(maxsize=1)
+def _watermark_stamp():
+    """Render the watermark text once; every image reuses the same overlay"""
     from PIL import Image, ImageDraw, ImageFont
-    draw = ImageDraw.Draw(img)
     font = ImageFont.load_default()
     text = "FreeStateDir©"
-    draw.text((10, img.height-30), text, (255,255,255), font=font)
+    left, top, right, bottom = font.getbbox(text)
+    stamp = Image.new('RGBA', (right, bottom), (0, 0, 0, 0))
+    ImageDraw.Draw(stamp).text((0, 0), text, (255, 255, 255, 255), font=font)
+    return stamp
+
+def add_watermark(img):
+    # Simplified watermark implementation
+    stamp = _watermark_stamp()
+    position = (10, img.height-30)
+    if img.mode == 'RGBA':
+        img.alpha_composite(stamp, position)
+    else:
+        img.paste(stamp, position, stamp)
     return img
 
-# Example usage
-generate_image("Bloemfontein cityscape at sunset", "frontend/public/assets/bloemfontein.jpg")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate location images")
+    parser.add_argument('--prompts', nargs='+', default=["Bloemfontein cityscape at sunset"])
+    parser.add_argument('--output-dir', default="frontend/public/assets/")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for prompt in args.prompts:
+        filename = prompt.replace(' ', '_').lower() + ".jpg"
+        generate_image(prompt, os.path.join(args.output_dir, filename))
@@ -0,0 +1,428 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics, services
+
+# Shared read-through cache for listing and user documents.
+#
+# Several agents read the same `listings/{id}` and `users/{id}` documents:
+# payment links, renewal reminders, featured posts and moderation. They now
+# go through one per-process cache. A hit never touches Firestore; a miss
+# reads the document (or a batch of them in one get_all) and keeps a compact
+# record with only the fields the agents use. Documents that do not exist
+# are cached too, so repeated lookups of a deleted listing stay cheap.
+#
+# By default entries simply expire after a short per-collection TTL. That
+# suits the scheduled agents, which run for minutes and exit: a listener's
+# first snapshot bills a read per document it covers, which a short-lived
+# process would never earn back. Long-running processes (the support bot)
+# call watch(), which puts a snapshot listener on each of the `max_watched`
+# most recently stored documents (never on whole collections). Writes from
+# any process then show up within a second or two, and those entries may
+# live for the much longer WATCHED_TTLS. Each listener is its own Listen
+# stream and client thread, so the watched set stays small: documents that
+# drop out of it fall back to the short TTLS, and expired entries are swept
+# (and unsubscribed) every SWEEP_INTERVAL. A client without listeners (local
+# fakes, emulators) polls the cached documents every POLL_INTERVAL instead.
+# The cache holds at most `max_entries` records, evicting the least recently
+# used.
+#
+# Agents that write a cached document should call put() or invalidate() so
+# their own next read sees the write without waiting for the listener.
+
+MAX_ENTRIES = int(os.getenv('LISTING_CACHE_SIZE', 20000))
+# How stale an unwatched entry may get
+TTLS = {'listings': 60, 'users': 300}
+# Safety net only: listeners keep watched entries current, these bound the
+# damage if one silently stops delivering
+WATCHED_TTLS = {'listings': 3 * 3600, 'users': 12 * 3600}
+# Documents with a snapshot listener at once
+MAX_WATCHED = int(os.getenv('LISTING_CACHE_WATCHED', 200))
+SWEEP_INTERVAL = 60
+POLL_INTERVAL = 5
+# Documents per get_all call
+BATCH_SIZE = 100
+
+_MISSING = object()
+
+
+class Record:
+    """Read-only document fields, with dict-style access for agent code"""
+
+    __slots__ = ('id',)
+    FIELDS = ()
+
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        for field in self.FIELDS:
+            setattr(self, field, data.get(field, _MISSING))
+
+    def get(self, field, default=None):
+        value = getattr(self, field, _MISSING) if field == 'id' or field in self.FIELDS else _MISSING
+        return default if value is _MISSING else value
+
+    def __getitem__(self, field):
+        value = self.get(field, _MISSING)
+        if value is _MISSING:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field):
+        return self.get(field, _MISSING) is not _MISSING
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not _MISSING}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.id == other.id and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.id}>"
+
+
+class ListingRecord(Record):
+    __slots__ = FIELDS = (
+        'owner_id', 'business_name', 'tier', 'expiry_date', 'category', 'services', 'description',
+        'town', 'region', 'address', 'phone', 'last_featured', 'status', 'moderated',
+    )
+
+
+class UserRecord(Record):
+    __slots__ = FIELDS = ('name', 'email', 'telegram_id')
+
+
+RECORD_TYPES = {'listings': ListingRecord, 'users': UserRecord}
+
+
+def _record_size(record):
+    if record is None:
+        return 0
+    return sys.getsizeof(record) + sum(sys.getsizeof(getattr(record, f)) for f in record.FIELDS
+                                       if getattr(record, f) is not _MISSING)
+
+
+class _Entry:
+    __slots__ = ('record', 'expires', 'size')
+
+    def __init__(self, record, expires):
+        self.record = record
+        self.expires = expires
+        self.size = _record_size(record)
+
+
+class ListingCache:
+    """Bounded LRU of document records, refreshed by snapshot listeners or polling"""
+
+    def __init__(self, db=None, max_entries=MAX_ENTRIES, ttls=None, poll_interval=POLL_INTERVAL, clock=time.monotonic,
+                 max_watched=MAX_WATCHED):
+        self._db = db
+        self.max_entries = max_entries
+        self.max_watched = max_watched
+        self.ttls = {**TTLS, **(ttls or {})}
+        self.watched_ttls = {**WATCHED_TTLS, **(ttls or {})}
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._entries = OrderedDict()  # (collection, doc_id) -> _Entry
+        # Keys being read; set to True if a change arrives before the read returns
+        self._reading = {}
+        self._lock = threading.Lock()
+        self._watching = False
+        self._listen = False
+        # (collection, doc_id) -> listener handle (None while subscribing), least recently used first
+        self._watches = OrderedDict()
+        self._next_sweep = 0
+        self._stop = threading.Event()
+        self._poller = None
+        self._bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    @property
+    def db(self):
+        return self._db or services.get_db()
+
+    # Reads
+
+    def get(self, collection, doc_id):
+        """Record for one document (None if it does not exist)"""
+        return self.get_many(collection, [doc_id])[doc_id]
+
+    def get_many(self, collection, doc_ids):
+        """{doc_id: record or None}; all misses are fetched in batched reads"""
+        record_type = self._record_type(collection)
+        found, missing = {}, []
+        now = self.clock()
+        with self._lock:
+            for doc_id in dict.fromkeys(doc_ids):
+                entry = self._entries.get((collection, doc_id))
+                if entry is not None and entry.expires > now:
+                    self._entries.move_to_end((collection, doc_id))
+                    if (collection, doc_id) in self._watches:
+                        self._watches.move_to_end((collection, doc_id))
+                    found[doc_id] = entry.record
+                else:
+                    missing.append(doc_id)
+                    self._reading.setdefault((collection, doc_id), False)
+            self.hits += len(found)
+            self.misses += len(missing)
+        if found:
+            metrics.counter('listing_cache_requests_total', "Listing cache lookups").inc(
+                len(found), collection=collection, result='hit')
+        if not missing:
+            return found
+
+        metrics.counter('listing_cache_requests_total', "Listing cache lookups").inc(
+            len(missing), collection=collection, result='miss')
+        try:
+            fetched = self._fetch(collection, record_type, missing)
+        finally:
+            with self._lock:
+                changed = {doc_id for doc_id in missing if self._reading.pop((collection, doc_id), False)}
+        for doc_id, record in fetched.items():
+            # A change that landed mid-read may be newer than what we fetched
+            if doc_id not in changed:
+                self._store(collection, doc_id, record)
+        found.update(fetched)
+        return found
+
+    def _fetch(self, collection, record_type, doc_ids):
+        db = self.db
+        records = dict.fromkeys(doc_ids)
+        with metrics.span('firestore_get', collection=collection):
+            if len(doc_ids) == 1:
+                snapshots = [db.collection(collection).document(doc_ids[0]).get()]
+            else:
+                snapshots = []
+                for start in range(0, len(doc_ids), BATCH_SIZE):
+                    refs = [db.collection(collection).document(doc_id)
+                            for doc_id in doc_ids[start:start + BATCH_SIZE]]
+                    snapshots.extend(db.get_all(refs))
+        for snapshot in snapshots:
+            records[snapshot.id] = record_type(snapshot.id, snapshot.to_dict()) if snapshot.exists else None
+        return records
+
+    @staticmethod
+    def _record_type(collection):
+        try:
+            return RECORD_TYPES[collection]
+        except KeyError:
+            raise ValueError(f"Collection is not cached: {collection}") from None
+
+    # Writes
+
+    def put(self, collection, doc_id, data):
+        """Cache a document the caller already read (or just wrote); returns its record"""
+        record = self._record_type(collection)(doc_id, data) if data is not None else None
+        self._store(collection, doc_id, record)
+        return record
+
+    def prime(self, collection, snapshots):
+        """Cache the documents of a query result; returns their records in order"""
+        records = []
+        for snapshot in snapshots:
+            records.append(self.put(collection, snapshot.id, snapshot.to_dict()))
+        return records
+
+    def invalidate(self, collection, doc_id=None):
+        """Drop one document, or every cached document of a collection"""
+        with self._lock:
+            keys = [(collection, doc_id)] if doc_id is not None else [k for k in self._entries if k[0] == collection]
+            for key in keys:
+                if key in self._reading:
+                    self._reading[key] = True
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._bytes -= entry.size
+                    self.invalidations += 1
+            dropped = [self._watches.pop(key) for key in keys if key in self._watches]
+        self._unsubscribe(dropped)
+
+    def _store(self, collection, doc_id, record):
+        key = (collection, doc_id)
+        now = self.clock()
+        dropped = []
+        with self._lock:
+            subscribe = False
+            if self._listen and self.max_watched > 0:
+                if key in self._watches:
+                    self._watches.move_to_end(key)
+                else:
+                    self._watches[key] = None  # claimed; subscribed below, outside the lock
+                    subscribe = True
+                watched = True
+            else:
+                # Polling keeps every entry current
+                watched = self._watching and not self._listen
+            ttl = (self.watched_ttls if watched else self.ttls).get(collection, 60)
+            entry = _Entry(record, now + ttl)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while len(self._entries) > self.max_entries:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+                if evicted_key in self._watches:
+                    dropped.append(self._watches.pop(evicted_key))
+            while len(self._watches) > self.max_watched:
+                # Least recently used watched document: unwatched, so short TTL
+                unwatched_key, watch = self._watches.popitem(last=False)
+                dropped.append(watch)
+                unwatched = self._entries.get(unwatched_key)
+                if unwatched is not None:
+                    unwatched.expires = min(unwatched.expires, now + self.ttls.get(unwatched_key[0], 60))
+            if now >= self._next_sweep:
+                dropped.extend(self._sweep(now))
+            subscribe = subscribe and key in self._watches
+        self._unsubscribe(dropped)
+        if subscribe:
+            self._subscribe(collection, doc_id)
+
+    def _sweep(self, now):
+        """Drop expired entries; returns their listeners. Caller holds self._lock"""
+        self._next_sweep = now + SWEEP_INTERVAL
+        dropped = []
+        for key in [key for key, entry in self._entries.items() if entry.expires <= now]:
+            self._bytes -= self._entries.pop(key).size
+            if key in self._watches:
+                dropped.append(self._watches.pop(key))
+        return dropped
+
+    @staticmethod
+    def _unsubscribe(watches):
+        for watch in watches:
+            # None: still subscribing; _subscribe sees the claim is gone
+            if watch is not None:
+                watch.unsubscribe()
+
+    def _subscribe(self, collection, doc_id):
+        key = (collection, doc_id)
+        watch = self.db.collection(collection).document(doc_id).on_snapshot(self._listener(collection, doc_id))
+        with self._lock:
+            if key in self._watches and self._watches[key] is None:
+                self._watches[key] = watch
+                return
+        # Evicted or invalidated while subscribing
+        watch.unsubscribe()
+
+    def _refresh(self, collection, doc_id, data):
+        """Apply a change from the database; only documents already cached are kept"""
+        key = (collection, doc_id)
+        with self._lock:
+            if key in self._reading:
+                self._reading[key] = True
+            cached = key in self._entries
+        if cached:
+            self.put(collection, doc_id, data)
+
+    # Invalidation
+
+    def watch(self):
+        """Keep cached documents current for a long-running process; returns self
+
+        The `max_watched` most recently stored documents each get their own
+        snapshot listener, whose first snapshot costs one read. Only worth it
+        when the process lives long enough to serve many hits per entry.
+        """
+        with self._lock:
+            if self._watching:
+                return self
+            self._watching = True
+        if hasattr(self.db.collection('listings').document('_'), 'on_snapshot'):
+            with self._lock:
+                self._listen = True
+                keys = list(self._entries)[-self.max_watched:] if self.max_watched > 0 else []
+                now = self.clock()
+                for key in keys:
+                    self._watches[key] = None
+                    self._entries[key].expires = now + self.watched_ttls.get(key[0], 60)
+            for collection, doc_id in keys:
+                self._subscribe(collection, doc_id)
+        else:
+            print(f"⚠️ No snapshot listeners; polling cached documents every {self.poll_interval}s")
+            self._poller = threading.Thread(target=self._poll, name='listing-cache-poll', daemon=True)
+            self._poller.start()
+        return self
+
+    def _listener(self, collection, doc_id):
+        def on_change(snapshots, changes, read_time):
+            doc = snapshots[0] if snapshots else None
+            self._refresh(collection, doc_id, doc.to_dict() if doc is not None and doc.exists else None)
+            metrics.counter('listing_cache_changes_total', "Document snapshots applied to the listing cache").inc(
+                collection=collection)
+        return on_change
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            for collection in RECORD_TYPES:
+                with self._lock:
+                    doc_ids = [doc_id for c, doc_id in self._entries if c == collection]
+                try:
+                    fetched = self._fetch(collection, self._record_type(collection), doc_ids) if doc_ids else {}
+                except Exception as e:
+                    print(f"Listing cache poll error: {str(e)}")
+                    continue
+                for doc_id, record in fetched.items():
+                    with self._lock:
+                        entry = self._entries.get((collection, doc_id))
+                    if entry is not None and entry.record != record:
+                        self._refresh(collection, doc_id, record.to_dict() if record is not None else None)
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._listen = False
+            watches = list(self._watches.values())
+            self._watches = OrderedDict()
+        self._unsubscribe(watches)
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
+
+    # Statistics
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'watched': len(self._watches),
+                'approx_kb': round(self._bytes / 1024, 1),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache shared by every agent (long-running processes also call watch())"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ListingCache()
+    return _cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read documents through the listing cache")
+    parser.add_argument('collection', choices=sorted(RECORD_TYPES))
+    parser.add_argument('doc_ids', nargs='+')
+    args = parser.parse_args()
+
+    cache = ListingCache()
+    for _ in range(2):
+        for doc_id, record in cache.get_many(args.collection, args.doc_ids).items():
+            print(doc_id, record.to_dict() if record is not None else None)
+    print(cache.stats())
@@ -0,0 +1,305 @@
+import atexit
+import bisect
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+
+# In-process counters, histograms and span timers for the agents.
+#
+# Everything is kept in memory and rendered in the Prometheus text format,
+# either to a file (AGENT_METRICS_FILE) or from a loopback HTTP endpoint, so
+# it works on CI runners without any metrics backend.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    # Exact for any count; '{:g}' would round 1234567 to 1.23457e+06
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    if value != value:
+        return "NaN"
+    if value in (float('inf'), float('-inf')):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    __slots__ = ('name', 'help', '_values', '_lock')
+
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram, optionally split by labels"""
+
+    __slots__ = ('name', 'help', 'buckets', '_series', '_lock')
+
+    def __init__(self, name, help="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # key -> [bucket counts..., sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels):
+        series = self._series.get(_label_key(labels))
+        return series[-1] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, hits in zip(self.buckets, series):
+                    cumulative += hits
+                    le = _format_labels(key, [('le', f"{bound:g}")])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                inf = _format_labels(key, [('le', "+Inf")])
+                lines.append(f"{self.name}_bucket{inf} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Named collection of metrics; asking twice returns the same metric"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, *args)
+        return metric
+
+    def counter(self, name, help=""):
+        return self._get_or_create(Counter, name, help)
+
+    def histogram(self, name, help="", buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help, buckets)
+
+    def render(self):
+        # Snapshot: other threads may register metrics while this renders
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help=""):
+    return REGISTRY.counter(name, help)
+
+
+def histogram(name, help="", buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help, buckets)
+
+
+class span:
+    """Time a block into `<name>_seconds`; failures also count `<name>_errors_total`
+
+        with metrics.span('scrape_fetch'):
+            response = requests.get(url)
+    """
+
+    __slots__ = ('_hist', '_name', '_labels', '_start')
+
+    def __init__(self, name, **labels):
+        self._hist = histogram(f"{name}_seconds", f"Time spent in {name}")
+        self._name = name
+        self._labels = labels
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._hist.observe(time.perf_counter() - self._start, **self._labels)
+        if exc_type is not None:
+            counter(f"{self._name}_errors_total", f"Failures in {self._name}").inc(**self._labels)
+        return False
+
+
+def timed(name, **labels):
+    """Decorator form of span()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def dump(path=None):
+    """Write the current metrics to a Prometheus text file"""
+    path = path or os.getenv('AGENT_METRICS_FILE', 'metrics.prom')
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(REGISTRY.render())
+        if _profiler is not None:
+            f.write(_profiler.render())
+    os.replace(tmp_path, path)
+    return path
+
+
+def serve(port=9108, addr='127.0.0.1'):
+    """Expose /metrics over HTTP from a daemon thread"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = REGISTRY.render()
+            if _profiler is not None:
+                body += _profiler.render()
+            body = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SamplingProfiler:
+    """Low-rate stack sampler for finding where agent time goes
+
+    Every 1/hz seconds it records the innermost frames of every other thread.
+    Results are rendered as the `agent_profile_samples` counter keyed by
+    `file:function` so they land in the same dump as everything else.
+    """
+
+    def __init__(self, hz=20, depth=3):
+        self.interval = 1.0 / hz
+        self.depth = depth
+        self.samples = collections.Counter()
+        # render() runs on the metrics server thread while samples are added
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                with self._lock:
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def render(self):
+        lines = ["# HELP agent_profile_samples Stack samples from the sampling profiler",
+                 "# TYPE agent_profile_samples counter"]
+        with self._lock:
+            top = self.samples.most_common(50)
+        for stack, hits in top:
+            lines.append(f'agent_profile_samples{{stack="{stack}"}} {hits}')
+        return "\n".join(lines) + "\n"
+
+
+_profiler = None
+
+
+def start_profiler(hz=None):
+    """Start the sampling profiler (AGENT_PROFILE_HZ sets the default rate)"""
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(hz=float(hz or os.getenv('AGENT_PROFILE_HZ', 20))).start()
+    return _profiler
+
+
+if os.getenv('AGENT_PROFILE_HZ'):
+    start_profiler()
+
+if os.getenv('AGENT_METRICS_FILE'):
+    atexit.register(dump)
@@ -0,0 +1,420 @@
+import argparse
+import asyncio
+import itertools
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+from . import metrics
+
+# Multi-process Rasa NLU serving for the support bot.
+#
+# Each worker process loads its own copy of the model and talks to the bot
+# process over a Unix socket pair. A sender always hashes to the same worker,
+# so Rasa's in-memory conversation tracker for that user lives in one place,
+# and a worker handles one message per sender at a time, in arrival order.
+# Replies resolve futures in the bot process, so a slow inference only delays
+# users routed to that worker.
+#
+# Each worker may have at most `max_pending` requests outstanding; beyond that
+# submit() raises Overloaded instead of queueing without bound. A monitor
+# thread pings every worker and restarts any that exit or stop answering,
+# failing their outstanding requests with WorkerLost. A restarted worker
+# starts with empty trackers unless Rasa is configured with a shared tracker
+# store.
+#
+# Restarts back off exponentially, and a worker that fails `max_start_restarts`
+# times in a row without ever loading its model is given up on: start() and
+# wait_ready() raise StartupFailed with the loader's error instead of waiting
+# on a broken model forever.
+
+NLU_WORKERS = int(os.getenv('NLU_WORKERS', os.cpu_count() or 1))
+MAX_PENDING = int(os.getenv('NLU_MAX_PENDING', 32))  # per worker
+REQUEST_TIMEOUT = 30
+HEALTH_INTERVAL = 5
+# A worker stuck this long on one inference is treated as hung
+HEALTH_TIMEOUT = 60
+# Conversations one worker interleaves while others wait on I/O
+WORKER_CONCURRENCY = 8
+# Seconds before the first restart, doubling per consecutive failure
+RESTART_BACKOFF = 1
+RESTART_BACKOFF_MAX = 60
+MAX_START_RESTARTS = 5
+# Long enough for every worker to load the Rasa model
+START_TIMEOUT = int(os.getenv('NLU_START_TIMEOUT', 300))
+
+
+class Overloaded(Exception):
+    """The sender's worker already has its maximum of outstanding requests"""
+
+
+class WorkerLost(Exception):
+    """The worker exited or was restarted while the request was outstanding"""
+
+
+class NLUError(Exception):
+    """The model raised while handling the message"""
+
+
+class StartupFailed(Exception):
+    """The workers could not load the model"""
+
+
+def load_rasa_agent(model_path=None):
+    """Default loader: the trained Rasa model as an async handler(text, sender_id)"""
+    from rasa.core.agent import Agent
+    from rasa.shared.constants import DEFAULT_MODELS_PATH
+
+    agent = Agent.load(model_path or os.path.join(DEFAULT_MODELS_PATH, "rasa_model.tar.gz"))
+
+    async def handle(text, sender_id):
+        return await agent.handle_text(text, sender_id=sender_id)
+
+    return handle
+
+
+def route(sender_id, workers):
+    """Worker index for a sender; stable across processes, unlike hash()"""
+    return zlib.crc32(str(sender_id).encode()) % workers
+
+
+def _worker_main(conn, loader, loader_args, concurrency):
+    # The bot process decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        handle = loader(*loader_args)
+    except Exception as e:
+        conn.send(('failed', None, f"{type(e).__name__}: {e}"))
+        return
+    conn.send(('ready', None, None))
+    asyncio.run(_serve(conn, handle, concurrency))
+
+
+async def _serve(conn, handle, concurrency):
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    senders = {}  # sender_id -> [lock, requests waiting or running]
+    tasks = set()
+
+    async def run(request_id, sender_id, text):
+        entry = senders.setdefault(sender_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], slots:
+                try:
+                    result = handle(text, sender_id)
+                    if asyncio.iscoroutine(result):
+                        result = await result
+                except Exception as e:
+                    conn.send(('error', request_id, f"{type(e).__name__}: {e}"))
+                else:
+                    conn.send(('reply', request_id, result))
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del senders[sender_id]
+
+    while True:
+        try:
+            message = await loop.run_in_executor(None, conn.recv)
+        except (EOFError, OSError):
+            # The bot process went away
+            break
+        kind = message[0]
+        if kind == 'stop':
+            break
+        if kind == 'ping':
+            conn.send(('pong', message[1], None))
+            continue
+        task = asyncio.create_task(run(*message[1:]))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class _Worker:
+    __slots__ = ('index', 'process', 'conn', 'send_lock', 'ready', 'inflight', 'last_seen', 'failures', 'error')
+
+    def __init__(self, index, process, conn, failures=0):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.ready = False
+        self.inflight = 0
+        self.last_seen = time.monotonic()
+        self.failures = failures  # restarts since this slot last loaded its model
+        self.error = None  # what the loader raised, if it did
+
+
+class NLUPool:
+    """N model-serving processes with sticky routing, backpressure and health checks"""
+
+    def __init__(self, workers=NLU_WORKERS, loader=load_rasa_agent, loader_args=(), max_pending=MAX_PENDING,
+                 concurrency=WORKER_CONCURRENCY, health_interval=HEALTH_INTERVAL, health_timeout=HEALTH_TIMEOUT,
+                 restart_backoff=RESTART_BACKOFF, max_start_restarts=MAX_START_RESTARTS):
+        self.size = max(1, workers)
+        self.loader = loader
+        self.loader_args = tuple(loader_args)
+        self.max_pending = max_pending
+        self.concurrency = concurrency
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.restart_backoff = restart_backoff
+        self.max_start_restarts = max_start_restarts
+        # spawn, not fork: the bot process has Telegram and Firebase threads running
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = [None] * self.size
+        self._pending = {}  # request_id -> (worker index, future)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._threads = []
+        self._respawning = {}  # worker index -> timer for its delayed restart
+        self._failed = None
+        self.restarts = 0
+
+    def start(self, wait_ready=True, timeout=None):
+        with self._lock:
+            for index in range(self.size):
+                self._spawn(index)
+        for target, name in ((self._collect, 'nlu-collector'), (self._monitor, 'nlu-monitor')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if wait_ready:
+            try:
+                if not self.wait_ready(timeout):
+                    raise StartupFailed(f"NLU workers not ready after {timeout}s")
+            except StartupFailed:
+                self.stop()
+                raise
+        return self
+
+    def wait_ready(self, timeout=None):
+        """Block until every worker has loaded its model
+
+        Returns False on timeout; raises StartupFailed once a worker is given up on.
+        """
+        with self._ready:
+            ready = self._ready.wait_for(lambda: self._failed or all(w.ready for w in self._workers), timeout)
+            if self._failed:
+                raise StartupFailed(self._failed)
+            return ready
+
+    def _spawn(self, index, failures=0):
+        # Caller holds self._lock
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, args=(child_conn, self.loader, self.loader_args, self.concurrency),
+            name=f"nlu-worker-{index}", daemon=True
+        )
+        process.start()
+        child_conn.close()
+        self._workers[index] = _Worker(index, process, parent_conn, failures)
+
+    def _restart(self, worker, reason):
+        """Replace a dead or hung worker (after a backoff) and fail what it was handling"""
+        with self._ready:
+            if (self._stop.is_set() or self._workers[worker.index] is not worker
+                    or worker.index in self._respawning):
+                return
+            lost = [(rid, future) for rid, (index, future) in self._pending.items() if index == worker.index]
+            for rid, _ in lost:
+                del self._pending[rid]
+            if not worker.ready and worker.failures >= self.max_start_restarts:
+                # Never loaded its model; restarting again will not help
+                self._failed = (f"NLU worker {worker.index} failed {worker.failures + 1} times without loading "
+                                f"its model: {worker.error or reason}")
+                self._ready.notify_all()
+                delay = None
+            else:
+                delay = min(self.restart_backoff * 2 ** worker.failures, RESTART_BACKOFF_MAX)
+                timer = threading.Timer(delay, self._respawn, (worker.index, worker.failures + 1))
+                timer.daemon = True
+                self._respawning[worker.index] = timer
+                timer.start()
+                self.restarts += 1
+        if delay is None:
+            print(f"❌ {self._failed}")
+        else:
+            print(f"⚠️ NLU worker {worker.index} restarting in {delay:g}s ({reason}); {len(lost)} requests lost")
+        metrics.counter('nlu_worker_restarts_total', "NLU worker processes restarted").inc(reason=reason)
+        worker.process.kill()
+        worker.process.join(timeout=5)
+        worker.conn.close()
+        for _, future in lost:
+            future.set_exception(WorkerLost(f"NLU worker {worker.index} {reason}"))
+
+    def _respawn(self, index, failures):
+        with self._lock:
+            self._respawning.pop(index, None)
+            if not self._stop.is_set():
+                self._spawn(index, failures)
+
+    def submit(self, sender_id, text):
+        """Queue a message on the sender's worker; returns a Future of Rasa's responses"""
+        future = Future()
+        index = route(sender_id, self.size)
+        with self._lock:
+            worker = self._workers[index]
+            if worker.conn.closed:
+                # Waiting out a restart backoff, or given up on
+                future.set_exception(WorkerLost(f"NLU worker {index} is restarting"))
+                return future
+            if worker.inflight >= self.max_pending:
+                metrics.counter('nlu_requests_total', "NLU requests").inc(status='overloaded')
+                raise Overloaded(f"NLU worker {index} has {worker.inflight} requests outstanding")
+            request_id = next(self._ids)
+            self._pending[request_id] = (index, future)
+            worker.inflight += 1
+        try:
+            with worker.send_lock:
+                worker.conn.send(('handle', request_id, str(sender_id), text))
+        except (OSError, ValueError):
+            # Restarted under us; the restart has already failed the future
+            with self._lock:
+                if self._pending.pop(request_id, None) is not None:
+                    future.set_exception(WorkerLost(f"NLU worker {index} is restarting"))
+        return future
+
+    def ask(self, sender_id, text, timeout=REQUEST_TIMEOUT):
+        """Rasa's responses for one message (blocks this thread only)"""
+        with metrics.span('nlu_request'):
+            return self.submit(sender_id, text).result(timeout)
+
+    def _resolve(self, worker, request_id, kind, payload):
+        with self._lock:
+            entry = self._pending.pop(request_id, None)
+            if entry is None:
+                return
+            if self._workers[entry[0]] is worker:
+                worker.inflight -= 1
+        future = entry[1]
+        if kind == 'reply':
+            metrics.counter('nlu_requests_total', "NLU requests").inc(status='ok')
+            future.set_result(payload)
+        else:
+            metrics.counter('nlu_requests_total', "NLU requests").inc(status='error')
+            future.set_exception(NLUError(payload))
+
+    def _collect(self):
+        while not self._stop.is_set():
+            with self._lock:
+                by_conn = {w.conn: w for w in self._workers if not w.conn.closed}
+            try:
+                ready = wait(list(by_conn), timeout=0.5)
+            except (OSError, ValueError):
+                # A connection was closed by a restart mid-wait
+                continue
+            for conn in ready:
+                worker = by_conn[conn]
+                try:
+                    kind, request_id, payload = conn.recv()
+                except (EOFError, OSError):
+                    if not self._stop.is_set():
+                        self._restart(worker, 'load_failed' if worker.error else 'exited')
+                    continue
+                worker.last_seen = time.monotonic()
+                if kind == 'ready':
+                    with self._ready:
+                        worker.ready = True
+                        worker.failures = 0
+                        self._ready.notify_all()
+                elif kind == 'failed':
+                    worker.error = payload
+                    print(f"❌ NLU worker {worker.index} could not load the model: {payload}")
+                elif kind in ('reply', 'error'):
+                    self._resolve(worker, request_id, kind, payload)
+
+    def _monitor(self):
+        while not self._stop.wait(self.health_interval):
+            with self._lock:
+                workers = list(self._workers)
+            now = time.monotonic()
+            for worker in workers:
+                if worker.conn.closed:
+                    # Already restarting
+                    continue
+                if not worker.process.is_alive():
+                    self._restart(worker, 'exited')
+                elif worker.ready and now - worker.last_seen > self.health_timeout:
+                    self._restart(worker, 'unresponsive')
+                elif worker.ready:
+                    try:
+                        with worker.send_lock:
+                            worker.conn.send(('ping', None))
+                    except (OSError, ValueError):
+                        self._restart(worker, 'exited')
+
+    def health(self):
+        """Per-worker status for health checks"""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'worker': w.index,
+                'pid': w.process.pid,
+                'alive': w.process.is_alive(),
+                'ready': w.ready,
+                'inflight': w.inflight,
+                'last_seen_seconds': round(now - w.last_seen, 1),
+            } for w in self._workers]
+
+    def healthy(self):
+        return all(w['alive'] and w['ready'] and w['last_seen_seconds'] < self.health_timeout
+                   for w in self.health())
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        with self._lock:
+            for timer in self._respawning.values():
+                timer.cancel()
+            self._respawning.clear()
+            workers = list(self._workers)
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for worker in workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(('stop',))
+            except (OSError, ValueError):
+                pass
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            worker.process.join(max(0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+            worker.conn.close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(WorkerLost("NLU pool stopped"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Try the NLU worker pool")
+    parser.add_argument('--workers', type=int, default=NLU_WORKERS)
+    parser.add_argument('--model', default=None, help="Rasa model archive (default: models/rasa_model.tar.gz)")
+    parser.add_argument('--sender', default='cli')
+    parser.add_argument('message', nargs='*', default=["hello"])
+    args = parser.parse_args()
+
+    pool = NLUPool(args.workers, loader_args=(args.model,)).start(timeout=START_TIMEOUT)
+    try:
+        for response in pool.ask(args.sender, " ".join(args.message)):
+            print(response.get('text'))
+        for status in pool.health():
+            print(status)
+    finally:
+        pool.stop()
@@ -1,7 +1,53 @@
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+
 import requests
-from firebase_admin import firestore
 
-def process_payment(user_id, amount, package):
+from . import metrics, revenue, services
+from .work_queue import WorkQueue
+
+# Webhook events are persisted here before PayFast gets its 200, then applied
+# to Firestore by a worker pool. The queue is keyed on pf_payment_id so
+# PayFast's ITN retries collapse into a single event.
+WEBHOOK_QUEUE_PATH = os.getenv('WEBHOOK_QUEUE_PATH', 'data/webhooks.sqlite3')
+
+# Events per Firestore transaction. Each writes its transaction document and
+# usually a listing, plus up to five revenue rollups shared across the batch
+# (one per user), so 50 events stay well under the 500-write limit
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', 50))
+
+# Renewal-day spikes are I/O bound on Firestore round trips, so size the pool
+# well beyond the core count
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 16))
+
+# Applied events are kept this long so late PayFast retries are still
+# recognised as duplicates (PayFast stops retrying long before), then purged
+WEBHOOK_RETENTION = 30 * 86400
+PURGE_INTERVAL = 3600
+
+# Paid tiers by renewal price (ZAR), matching customer_support.generate_payment_link
+TIER_PRICES = {Decimal('800.00'): 'large_business', Decimal('300.00'): 'independent'}
+RENEWAL_PERIOD = 30 * 86400  # seconds added to expiry_date per payment
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue():
+    """Shared webhook queue, opened on first use"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                # PayFast gets its 200 once the event is stored, so a stored
+                # event must survive power loss
+                _queue = WorkQueue(WEBHOOK_QUEUE_PATH, name='payfast_webhooks', synchronous='FULL')
+    return _queue
+
+def process_payment(user_id, amount, package, listing_id=None):
     payload = {
         "merchant_id": os.getenv("PAYFAST_MERCHANT_ID"),
         "merchant_key": os.getenv("PAYFAST_MERCHANT_KEY"),
@@ -12,28 +58,253 @@ def process_payment(user_id, amount, package):
         "notify_url": "https://yourdomain.com/payfast-webhook",
         "custom_int1": user_id
     }
+    if listing_id:
+        # Echoed back in the ITN so the payment upgrades this listing
+        payload["custom_str1"] = listing_id
     
     response = requests.post("https://www.payfast.co.za/eng/process", data=payload)
     return response.url  # Redirect user to this URL
 
+@metrics.timed('payfast_webhook')
 def handle_webhook(data):
-    db = firestore.client()
-    if data['payment_status'] == 'COMPLETE':
-        user_id = data['custom_int1']
-        amount = float(data['amount_gross'])
-        
-        # Apply revenue split
-        owner_share = amount * 0.60
-        ai_fund = amount * 0.40
-        
-        # Update Firestore
-        db.collection('transactions').document(data['pf_payment_id']).set({
-            'user_id': user_id,
-            'amount': amount,
-            'owner_share': owner_share,
-            'ai_fund': ai_fund,
-            'timestamp': firestore.SERVER_TIMESTAMP
-        })
-        
-        # Upgrade listing
-        upgrade_listing(user_id, data['item_name'])
+    """Persist a PayFast ITN and return immediately
+
+    Returns False for a replay of an event already received. Either way the
+    caller should answer PayFast with 200 so it stops retrying. The payment is
+    booked on the day it was first received, however late it is applied.
+    """
+    key = f"{data['pf_payment_id']}:{data.get('payment_status', '')}"
+    added = get_queue().put(key, {**data, 'received_at': time.time()})
+    metrics.counter('payfast_webhooks_total', "PayFast ITNs received").inc(duplicate=not added)
+    return added
+
+def validate_event(event):
+    """Raise ValueError if apply_events could never record this ITN"""
+    if event.get('payment_status') != 'COMPLETE':
+        return
+    if not event.get('pf_payment_id'):
+        raise ValueError("missing pf_payment_id")
+    if not event.get('custom_int1'):
+        raise ValueError("missing custom_int1 (payer)")
+    try:
+        revenue.to_decimal(event.get('amount_gross'))
+    except ArithmeticError:
+        raise ValueError(f"bad amount_gross {event.get('amount_gross')!r}") from None
+
+def apply_events(events, db=None):
+    """Apply a batch of webhook payloads in one Firestore transaction
+
+    Payments already recorded in `transactions` (or repeated within the batch)
+    are skipped, so re-applying a batch after a crash is harmless. Returns the
+    number of payments newly applied.
+    """
+    from firebase_admin import firestore
+
+    db = db or services.get_db()
+    complete = [e for e in events if e.get('payment_status') == 'COMPLETE']
+    if not complete:
+        return 0
+
+    event_listings = _resolve_listings(complete, db)
+    unmatched = []
+
+    @firestore.transactional
+    def apply(transaction):
+        unmatched.clear()
+        tx_refs = {e['pf_payment_id']: db.collection('transactions').document(e['pf_payment_id'])
+                   for e in complete}
+        listing_ids = set(event_listings.values())
+        listing_refs = {lid: db.collection('listings').document(lid) for lid in listing_ids}
+
+        # All reads happen before any write, as Firestore transactions require
+        snapshots = list(db.get_all(list(tx_refs.values()) + list(listing_refs.values()),
+                                    transaction=transaction))
+        recorded = {snap.id for snap in snapshots
+                    if snap.exists and snap.reference.path.startswith('transactions/')}
+        listings = {snap.id: snap.to_dict() for snap in snapshots
+                    if snap.exists and snap.reference.path.startswith('listings/')}
+
+        now = time.time()
+        upgrades = {}
+        records = []
+        for event in complete:
+            payment_id = event['pf_payment_id']
+            if payment_id in recorded:
+                continue
+            recorded.add(payment_id)
+
+            user_id = event['custom_int1']
+            listing_id = event_listings.get(payment_id)
+            amount, owner_share, ai_fund = revenue.split(event['amount_gross'])
+            tier = TIER_PRICES.get(amount) or listings.get(listing_id, {}).get('tier')
+            # Events queued before received_at was stamped are booked now
+            received_at = datetime.fromtimestamp(event.get('received_at') or now, timezone.utc)
+
+            # Apply revenue split (exact decimal strings; Firestore has no decimal type)
+            record = {
+                'user_id': user_id,
+                'listing_id': listing_id,
+                'item_name': event.get('item_name'),
+                'tier': tier,
+                'amount': str(amount),
+                'owner_share': str(owner_share),
+                'ai_fund': str(ai_fund),
+                'day': revenue.payment_day(received_at),
+                'received_at': received_at,
+                'timestamp': firestore.SERVER_TIMESTAMP
+            }
+            transaction.set(tx_refs[payment_id], record)
+            records.append(record)
+
+            if listing_id in listings:
+                upgrade = upgrades.setdefault(listing_id, {
+                    'expiry_date': max(listings[listing_id].get('expiry_date') or 0, now)
+                })
+                upgrade['expiry_date'] += RENEWAL_PERIOD
+                upgrade['tier'] = tier
+                upgrade['last_payment_id'] = payment_id
+            else:
+                unmatched.append(payment_id)
+
+        # Upgrade listings
+        for listing_id, upgrade in upgrades.items():
+            transaction.update(listing_refs[listing_id], upgrade)
+
+        # Keep per-day/month/tier/user totals current in the same commit
+        revenue.apply_increments(transaction, db, records)
+        return len(records)
+
+    with metrics.span('webhook_apply_batch'):
+        applied = apply(db.transaction())
+    metrics.counter('payfast_payments_applied_total', "Payments recorded in Firestore").inc(applied)
+    if unmatched:
+        # Recorded and counted in revenue, but no listing was extended
+        print(f"⚠️ {len(unmatched)} payment(s) matched no listing: {', '.join(unmatched)}")
+        metrics.counter('payfast_payments_unmatched_total',
+                        "Payments recorded without a listing to upgrade").inc(len(unmatched))
+    return applied
+
+def _resolve_listings(events, db):
+    """pf_payment_id -> listing the payment renews
+
+    Payment links carry the listing in custom_str1. Older links only carried
+    the payer (custom_int1), so those fall back to the payer's listing when
+    they own exactly one; anything ambiguous is left unmatched.
+    """
+    resolved = {}
+    owned = {}
+    for event in events:
+        listing_id = event.get('custom_str1')
+        user_id = event.get('custom_int1')
+        if not listing_id and user_id:
+            if user_id not in owned:
+                query = db.collection('listings').where('owner_id', '==', str(user_id))
+                owned[user_id] = [snap.id for snap in query.limit(2).stream()]
+            if len(owned[user_id]) == 1:
+                listing_id = owned[user_id][0]
+        if listing_id:
+            resolved[event['pf_payment_id']] = listing_id
+    return resolved
+
+class WebhookWorkerPool:
+    """Threads that drain the webhook queue into Firestore in batches"""
+
+    def __init__(self, workers=WEBHOOK_WORKERS, batch_size=WEBHOOK_BATCH_SIZE, queue=None, db=None,
+                 idle_sleep=0.5, retention=WEBHOOK_RETENTION, purge_interval=PURGE_INTERVAL):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue = queue or get_queue()
+        self.db = db
+        self.idle_sleep = idle_sleep
+        self.retention = retention
+        self.purge_interval = purge_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def process_once(self, owner=None):
+        """Claim and apply one batch; returns the number of events claimed"""
+        claimed = self.queue.claim(self.batch_size, owner=owner)
+        if not claimed:
+            return 0
+        valid = []
+        for key, payload in claimed:
+            try:
+                validate_event(payload)
+            except ValueError as e:
+                # Retrying cannot fix a malformed ITN; park it for a human
+                print(f"⚠️ Rejected webhook {key}: {e}")
+                metrics.counter('payfast_webhooks_rejected_total', "Malformed ITNs parked as dead").inc()
+                self.queue.fail([key], error=str(e), retry=False)
+            else:
+                valid.append((key, payload))
+        if valid:
+            self._apply(valid)
+        return len(claimed)
+
+    def _apply(self, items):
+        keys = [key for key, _ in items]
+        try:
+            apply_events([payload for _, payload in items], db=self.db)
+        except Exception as e:
+            if len(items) > 1:
+                # Apply one at a time so an event that still fails cannot
+                # take the rest of its batch down with it
+                for item in items:
+                    self._apply([item])
+                return
+            print(f"Webhook error: {str(e)}")
+            self.queue.fail(keys, error=str(e))
+        else:
+            self.queue.ack(keys)
+
+    def _run(self):
+        owner = uuid.uuid4().hex
+        while not self._stop.is_set():
+            if not self.process_once(owner):
+                self._stop.wait(self.idle_sleep)
+
+    def _purge(self):
+        """Drop applied events past the retention window so the queue stays small"""
+        while not self._stop.wait(self.purge_interval):
+            try:
+                purged = self.queue.purge(self.retention)
+            except Exception as e:
+                print(f"Webhook purge error: {str(e)}")
+                continue
+            metrics.counter('payfast_webhooks_purged_total', "Applied ITNs dropped after retention").inc(purged)
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._purge, name='webhook-purge', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def drain(self, timeout=None):
+        """Block until nothing is pending or leased"""
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            stats = self.queue.stats()
+            if not stats['pending'] and not stats['leased']:
+                return True
+            if deadline and time.time() > deadline:
+                return False
+            time.sleep(0.05)
+
+if __name__ == "__main__":
+    pool = WebhookWorkerPool().start()
+    print(f"💳 Webhook workers running ({pool.workers} threads)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,166 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from .crawler import CRAWL_DB_PATH
+
+# Change-driven re-crawl planning.
+#
+# For every directory page we keep a fingerprint of the cards it listed, how
+# often a visit found that fingerprint changed, and when the page is next
+# due. The change rate is estimated with Cho & Garcia-Molina's estimator for
+# pages that can change more than once between visits, over decayed visit
+# counts so it follows a page whose behaviour shifts. A page is revisited
+# after the interval in which it has even odds of having changed, clamped to
+# [MIN_REVISIT, MAX_REVISIT]. A fetched page whose fingerprint matches the
+# last visit skips card extraction.
+
+DAY = 86400
+MIN_REVISIT = DAY
+MAX_REVISIT = 30 * DAY
+# Older visits count for less, so the estimate follows changes in behaviour
+DECAY = 0.9
+# Nightly runs do not start at exactly the same time
+DUE_SLACK = 6 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawl_pages (
+    url           TEXT PRIMARY KEY,
+    region        TEXT NOT NULL,
+    fingerprint   TEXT,
+    next_url      TEXT,
+    last_visit    REAL NOT NULL,
+    next_visit    REAL NOT NULL,
+    visits        REAL NOT NULL DEFAULT 0,
+    changes       REAL NOT NULL DEFAULT 0,
+    visit_days    REAL NOT NULL DEFAULT 0,
+    change_rate   REAL NOT NULL DEFAULT 0,
+    total_visits  INTEGER NOT NULL DEFAULT 1,
+    total_changes INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS crawl_pages_due ON crawl_pages (next_visit);
+"""
+
+
+def fingerprint(cards):
+    """Hash of a page's card set: card text only, order-independent"""
+    digest = hashlib.sha256()
+    for text in sorted(card.get_text('\x1f', strip=True) for card in cards):
+        digest.update(text.encode())
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+def estimate_rate(visits, changes, visit_days):
+    """Changes per day from (decayed) visit and detected-change counts
+
+    A visit only shows whether the page changed at least once since the last
+    one, so changes/time undercounts busy pages; this estimator corrects for
+    it. Half a pseudo-change over one pseudo-visit keeps early estimates sane.
+    """
+    if visits <= 0 or visit_days <= 0:
+        return 0.0
+    n, x = visits + 1, changes + 0.5
+    return -math.log((n - x + 0.5) / (n + 0.5)) / (visit_days / visits)
+
+
+def revisit_interval(rate):
+    """Seconds until the page has even odds of having changed"""
+    if rate <= 0:
+        return MAX_REVISIT
+    return min(MAX_REVISIT, max(MIN_REVISIT, math.log(2) / rate * DAY))
+
+
+class RecrawlPlanner:
+    """Per-page fingerprints and revisit schedule, stored beside the crawl frontier"""
+
+    def __init__(self, path=CRAWL_DB_PATH, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def page(self, url):
+        row = self._conn().execute('SELECT * FROM crawl_pages WHERE url = ?', (url,)).fetchone()
+        return dict(row) if row else None
+
+    def is_due(self, url):
+        """Unknown pages are always due"""
+        row = self._conn().execute('SELECT next_visit FROM crawl_pages WHERE url = ?', (url,)).fetchone()
+        return row is None or row[0] <= self.clock() + DUE_SLACK
+
+    def has_changed(self, url, page_fingerprint):
+        row = self._conn().execute('SELECT fingerprint FROM crawl_pages WHERE url = ?', (url,)).fetchone()
+        return row is None or row[0] != page_fingerprint
+
+    def due_pages(self):
+        """(url, region) of known pages due for a visit in this run"""
+        return [tuple(row) for row in self._conn().execute(
+            'SELECT url, region FROM crawl_pages WHERE next_visit <= ? ORDER BY next_visit',
+            (self.clock() + DUE_SLACK,)
+        )]
+
+    def record_visit(self, url, region, page_fingerprint, next_url):
+        """Store what a visit found and schedule the next one; returns whether it changed
+
+        Call after the page's cards are saved: a crash in between then
+        re-extracts the page rather than skipping unsaved cards.
+        """
+        now = self.clock()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT * FROM crawl_pages WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                # First sighting: look again tomorrow to start learning its rate
+                conn.execute(
+                    'INSERT INTO crawl_pages (url, region, fingerprint, next_url, last_visit, next_visit) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (url, region, page_fingerprint, next_url, now, now + MIN_REVISIT)
+                )
+                changed = True
+            else:
+                changed = row['fingerprint'] != page_fingerprint
+                visits = row['visits'] * DECAY + 1
+                changes = row['changes'] * DECAY + changed
+                visit_days = row['visit_days'] * DECAY + (now - row['last_visit']) / DAY
+                rate = estimate_rate(visits, changes, visit_days)
+                conn.execute(
+                    'UPDATE crawl_pages SET fingerprint = ?, next_url = ?, last_visit = ?, next_visit = ?, '
+                    'visits = ?, changes = ?, visit_days = ?, change_rate = ?, '
+                    'total_visits = total_visits + 1, total_changes = total_changes + ? WHERE url = ?',
+                    (page_fingerprint, next_url, now, now + revisit_interval(rate),
+                     visits, changes, visit_days, rate, int(changed), url)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return changed
+
+    def stats(self):
+        row = self._conn().execute(
+            'SELECT COUNT(*), SUM(next_visit <= ?), AVG(change_rate) FROM crawl_pages',
+            (self.clock() + DUE_SLACK,)
+        ).fetchone()
+        return {'pages': row[0], 'due': row[1] or 0, 'mean_change_rate': round(row[2] or 0.0, 4)}
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
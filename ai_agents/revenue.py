@@ -0,0 +1,209 @@
+import argparse
+import os
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+from . import services
+
+# Revenue rollups.
+#
+# Every applied payment increments a handful of small documents in
+# `revenue_rollups` (overall, per day, per month, per tier and per user) in
+# the same Firestore transaction that records it, so dashboards and payout
+# reports read a few documents instead of scanning `transactions`.
+#
+# Every webhook batch touches the overall, day, month and tier rollups, and
+# Firestore sustains only about one write per second per document, so those
+# are split over ROLLUP_SHARDS documents (`all#0` .. `all#9`). Each batch
+# increments one shard picked at random and get_rollup() sums them. Per-user
+# rollups are not hot and stay single documents. Lowering ROLLUP_SHARDS
+# needs a rebuild(), which folds each rollup back into shard 0.
+#
+# Money is handled as Decimal and stored in rollups as integer cents, which
+# Firestore can increment atomically without any float rounding.
+
+ROLLUP_COLLECTION = 'revenue_rollups'
+
+OWNER_SHARE = Decimal('0.60')
+CENT = Decimal('0.01')
+
+# Payment days are counted in SAST (UTC+2, no daylight saving)
+SAST = timezone(timedelta(hours=2))
+
+FIELDS = ('amount_cents', 'owner_share_cents', 'ai_fund_cents')
+
+ROLLUP_SHARDS = int(os.getenv('REVENUE_ROLLUP_SHARDS', 10))
+
+
+def to_decimal(value):
+    """Parse a money amount (PayFast string, legacy float or Decimal) exactly"""
+    if isinstance(value, float):
+        value = repr(value)
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def from_cents(cents):
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+def split(amount):
+    """Revenue split: 60% owner, the remainder to the AI fund (sums exactly)"""
+    amount = to_decimal(amount)
+    owner_share = (amount * OWNER_SHARE).quantize(CENT, rounding=ROUND_HALF_UP)
+    return amount, owner_share, amount - owner_share
+
+
+def payment_day(when=None):
+    """ISO date (SAST) a payment is booked under"""
+    when = when or datetime.now(timezone.utc)
+    return when.astimezone(SAST).date().isoformat()
+
+
+def rollup_ids(day, tier, user_id):
+    ids = ['all', f"day:{day}", f"month:{day[:7]}", f"user:{user_id}"]
+    if tier:
+        ids.append(f"tier:{tier}")
+    return ids
+
+
+def is_sharded(rollup_id):
+    return not rollup_id.startswith('user:')
+
+
+def shard_id(rollup_id, shard):
+    """Document id holding one shard of a rollup"""
+    return f"{rollup_id}#{shard}" if is_sharded(rollup_id) else rollup_id
+
+
+def record_fields(record):
+    """Cents for one transaction document"""
+    amount, owner_share, ai_fund = split(record['amount'])
+    return {
+        'amount_cents': int(amount * 100),
+        'owner_share_cents': int(owner_share * 100),
+        'ai_fund_cents': int(ai_fund * 100),
+    }
+
+
+def apply_increments(transaction, db, records):
+    """Add a batch of new transaction records to their rollups
+
+    Called inside the webhook transaction; increments for the same rollup are
+    summed first so each document is written once per batch, all to one
+    randomly chosen shard.
+    """
+    from firebase_admin import firestore
+
+    totals = _accumulate(records)
+    shard = random.randrange(ROLLUP_SHARDS)
+    for rollup_id, values in totals.items():
+        ref = db.collection(ROLLUP_COLLECTION).document(shard_id(rollup_id, shard))
+        transaction.set(ref, {
+            **{field: firestore.Increment(value) for field, value in values.items()},
+            'updated_at': firestore.SERVER_TIMESTAMP
+        }, merge=True)
+
+
+def _accumulate(records, totals=None):
+    totals = totals if totals is not None else defaultdict(lambda: dict.fromkeys(FIELDS + ('count',), 0))
+    for record in records:
+        fields = record_fields(record)
+        for rollup_id in rollup_ids(record['day'], record.get('tier'), record['user_id']):
+            values = totals[rollup_id]
+            for field, cents in fields.items():
+                values[field] += cents
+            values['count'] += 1
+    return totals
+
+
+def get_rollup(rollup_id, db=None):
+    """Read one rollup ('all', 'day:2024-03-01', 'month:2024-03', 'tier:independent', 'user:<id>')"""
+    db = db or services.get_db()
+    rollups = db.collection(ROLLUP_COLLECTION)
+    if is_sharded(rollup_id):
+        # Every shard, plus the single document written before sharding
+        refs = [rollups.document(shard_id(rollup_id, shard)) for shard in range(ROLLUP_SHARDS)]
+        snapshots = db.get_all(refs + [rollups.document(rollup_id)])
+    else:
+        snapshots = [rollups.document(rollup_id).get()]
+    data = defaultdict(int)
+    for snapshot in snapshots:
+        for field, value in (snapshot.to_dict() or {}).items():
+            if field in FIELDS or field == 'count':
+                data[field] += value
+    return {
+        'count': data.get('count', 0),
+        'amount': from_cents(data.get('amount_cents', 0)),
+        'owner_share': from_cents(data.get('owner_share_cents', 0)),
+        'ai_fund': from_cents(data.get('ai_fund_cents', 0)),
+    }
+
+
+def rebuild(db=None, batch_size=400):
+    """Recompute every rollup from `transactions` in one streaming pass
+
+    Pause the webhook workers while this runs; payments applied mid-rebuild
+    would otherwise be overwritten.
+    """
+    from firebase_admin import firestore
+
+    db = db or services.get_db()
+    totals = None
+    scanned = 0
+    for doc in db.collection('transactions').stream():
+        record = doc.to_dict()
+        if 'day' not in record:
+            # Written before rollups existed: book it by its server timestamp
+            timestamp = record.get('timestamp')
+            record['day'] = payment_day(timestamp if isinstance(timestamp, datetime) else None)
+        totals = _accumulate([record], totals)
+        scanned += 1
+
+    # Each rollup lands whole in its first shard; the other shards are stale
+    written = {shard_id(rollup_id, 0): values for rollup_id, values in (totals or {}).items()}
+    stale = {doc.id for doc in db.collection(ROLLUP_COLLECTION).stream()} - set(written)
+
+    batch = db.batch()
+    pending = 0
+    for rollup_id, values in written.items():
+        batch.set(db.collection(ROLLUP_COLLECTION).document(rollup_id),
+                  {**values, 'updated_at': firestore.SERVER_TIMESTAMP})
+        pending += 1
+        if pending == batch_size:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    for rollup_id in stale:
+        batch.delete(db.collection(ROLLUP_COLLECTION).document(rollup_id))
+        pending += 1
+        if pending == batch_size:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+
+    print(f"✅ Rebuilt {len(totals or {})} revenue rollups from {scanned} transactions")
+    return scanned
+
+
+def report(rollup_ids=None, db=None):
+    """Print rollups (default: all, today, this month)"""
+    today = payment_day()
+    for rollup_id in rollup_ids or ['all', f"day:{today}", f"month:{today[:7]}"]:
+        rollup = get_rollup(rollup_id, db)
+        print(f"{rollup_id}: {rollup['count']} payments, R{rollup['amount']} "
+              f"(owner R{rollup['owner_share']}, AI fund R{rollup['ai_fund']})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Revenue rollups")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute rollups from transactions")
+    parser.add_argument('--report', nargs='*', default=None,
+                        help="Rollup ids to print (default: all, today, this month)")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild()
+    if args.report is not None or not args.rebuild:
+        report(args.report)
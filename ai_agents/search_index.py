@@ -0,0 +1,466 @@
+import argparse
+import bisect
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from array import array
+
+from . import services
+
+# In-process listing search for the support bot.
+#
+# A BM25 inverted index over the listing text fields, boosted by tier. The
+# base index is an immutable file that is memory-mapped at startup; listing
+# changes go into a small in-memory delta (with tombstones for replaced or
+# deleted listings) until compact() folds them into a new file. The listener
+# compacts once the delta reaches COMPACT_AFTER listings, so the first start
+# without a base file writes one from the listener's initial snapshot.
+#
+# Each base listing keeps a digest of the content it was indexed from. A
+# listener's initial snapshot delivers every listing as added; listings whose
+# digest matches the base are skipped rather than copied into the delta.
+#
+# File layout (little-endian):
+#   8s   magic
+#   u32  header length, then the JSON header (terms, doc ids and display fields)
+#   pad to 4 bytes
+#   u32[n_terms + 1]  postings offsets
+#   u32[n_postings]   doc numbers
+#   f32[n_postings]   field-weighted term frequencies
+#   f32[n_docs]       document lengths
+#   f32[n_docs]       tier boosts
+#   u32[n_docs]       content digests
+
+INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', 'data/listings.idx')
+MAGIC = b'FSDIDX02'
+# Delta size at which the listener folds it into a new base file
+COMPACT_AFTER = 1000
+
+FIELD_WEIGHTS = {
+    'business_name': 3.0,
+    'category': 2.5,
+    'town': 2.0,
+    'region': 1.5,
+    'services': 1.5,
+    'description': 1.0,
+}
+TIER_BOOST = {'large_business': 1.3, 'independent': 1.15, 'free': 1.0}
+DISPLAY_FIELDS = ('business_name', 'category', 'town', 'tier')
+
+STOPWORDS = {
+    'a', 'an', 'and', 'any', 'are', 'around', 'at', 'for', 'find', 'i', 'in', 'is', 'me',
+    'my', 'near', 'of', 'on', 'or', 'search', 'the', 'to', 'where', 'with',
+}
+
+K1 = 1.2
+B = 0.75
+PREFIX_WEIGHT = 0.6  # score factor for a prefix expansion of a query term
+TYPO_WEIGHT = 0.5    # score factor for a term one edit away
+MAX_EXPANSIONS = 20
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def tokenize(text):
+    """Lowercase words with a light plural strip ('plumbers' -> 'plumber')"""
+    tokens = []
+    for token in _TOKEN_RE.findall(str(text).lower()):
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def listing_terms(listing):
+    """Field-weighted term frequencies and total length for one listing"""
+    weights = {}
+    length = 0.0
+    for field, weight in FIELD_WEIGHTS.items():
+        value = listing.get(field)
+        if isinstance(value, (list, tuple)):
+            value = " ".join(map(str, value))
+        for token in tokenize(value or ""):
+            weights[token] = weights.get(token, 0.0) + weight
+            length += weight
+    return weights, length
+
+
+def _edits1(word):
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    deletes = [l + r[1:] for l, r in splits if r]
+    transposes = [l + r[1] + r[0] + r[2:] for l, r in splits if len(r) > 1]
+    replaces = [l + c + r[1:] for l, r in splits if r for c in _LETTERS + '0123456789']
+    inserts = [l + c + r for l, r in splits for c in _LETTERS]
+    return set(deletes + transposes + replaces + inserts)
+
+
+def index_entry(listing_id, listing):
+    """(listing_id, weights, length, boost, display, digest) for one listing"""
+    weights, length = listing_terms(listing)
+    boost = TIER_BOOST.get(listing.get('tier'), 1.0)
+    display = [listing.get(field) for field in DISPLAY_FIELDS]
+    digest = zlib.crc32(json.dumps([weights, length, boost, display], sort_keys=True, default=str).encode())
+    return listing_id, weights, length, boost, display, digest
+
+
+def write_index(path, entries):
+    """Write index entries (see index_entry) to a new index file"""
+    ids = []
+    display = []
+    doc_len = array('f')
+    boosts = array('f')
+    digests = array('I')
+    postings = {}
+    for doc, (listing_id, weights, length, boost, shown, digest) in enumerate(entries):
+        ids.append(listing_id)
+        display.append(shown)
+        doc_len.append(length)
+        boosts.append(boost)
+        digests.append(digest)
+        for term, tf in weights.items():
+            postings.setdefault(term, []).append((doc, tf))
+
+    terms = sorted(postings)
+    offsets = array('I', [0])
+    docs = array('I')
+    tfs = array('f')
+    for term in terms:
+        for doc, tf in postings[term]:
+            docs.append(doc)
+            tfs.append(tf)
+        offsets.append(len(docs))
+
+    header = json.dumps({'terms': terms, 'ids': ids, 'display': display}, separators=(',', ':')).encode()
+    padding = b'\0' * (-(len(MAGIC) + 4 + len(header)) % 4)
+
+    tmp_path = f"{path}.tmp"
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(padding)
+        for block in (offsets, docs, tfs, doc_len, boosts, digests):
+            block.tofile(f)
+    os.replace(tmp_path, path)
+    return len(ids)
+
+
+class SearchIndex:
+    """Memory-mapped base index plus an in-memory delta for recent changes"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._mmap = None
+        self.terms = []
+        self.ids = []
+        self.display = []
+        self._doc_by_id = {}
+        self._offsets = self._docs = self._tfs = self._doc_len = self._boosts = self._digests = \
+            memoryview(b'').cast('I')
+        self._np = None
+        # Delta: listings added or changed since the base file was written
+        self._delta = {}          # listing_id -> (weights, length, boost, display, digest)
+        self._delta_postings = {}  # term -> {listing_id: tf}
+        self._tombstones = set()  # base doc numbers superseded by the delta
+        if path and os.path.exists(path):
+            self._load(path)
+
+    def _load(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"Not a listing index: {path}")
+        (header_len,) = struct.unpack_from('<I', buf, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(bytes(buf[start:start + header_len]))
+        self.terms = header['terms']
+        self.ids = header['ids']
+        self.display = header['display']
+        self._doc_by_id = {listing_id: doc for doc, listing_id in enumerate(self.ids)}
+
+        pos = start + header_len
+        pos += -pos % 4
+        n_terms, n_docs = len(self.terms), len(self.ids)
+
+        def take(fmt, count):
+            nonlocal pos
+            view = buf[pos:pos + 4 * count].cast(fmt)
+            pos += 4 * count
+            return view
+
+        self._offsets = take('I', n_terms + 1)
+        n_postings = self._offsets[-1] if n_terms else 0
+        self._docs = take('I', n_postings)
+        self._tfs = take('f', n_postings)
+        self._doc_len = take('f', n_docs)
+        self._boosts = take('f', n_docs)
+        self._digests = take('I', n_docs)
+
+        try:
+            import numpy as np
+        except ImportError:
+            self._np = None
+        else:
+            # Zero-copy views over the mapped file
+            self._np = {name: np.frombuffer(getattr(self, f"_{name}"), dtype=dtype)
+                        for name, dtype in (('docs', np.uint32), ('tfs', np.float32),
+                                            ('doc_len', np.float32), ('boosts', np.float32))}
+
+    # Incremental updates
+
+    def upsert(self, listing_id, listing):
+        """Add or replace a listing without rewriting the base file
+
+        Returns False if the base file already has this exact listing.
+        """
+        _, weights, length, boost, display, digest = index_entry(listing_id, listing)
+        with self._lock:
+            doc = self._doc_by_id.get(listing_id)
+            if (doc is not None and doc not in self._tombstones and listing_id not in self._delta
+                    and self._digests[doc] == digest):
+                return False
+            self._drop_delta(listing_id)
+            if doc is not None:
+                self._tombstones.add(doc)
+            self._delta[listing_id] = (weights, length, boost, display, digest)
+            for term, tf in weights.items():
+                self._delta_postings.setdefault(term, {})[listing_id] = tf
+        return True
+
+    def remove(self, listing_id):
+        with self._lock:
+            self._drop_delta(listing_id)
+            if listing_id in self._doc_by_id:
+                self._tombstones.add(self._doc_by_id[listing_id])
+
+    def _drop_delta(self, listing_id):
+        previous = self._delta.pop(listing_id, None)
+        if previous:
+            for term in previous[0]:
+                postings = self._delta_postings.get(term)
+                if postings:
+                    postings.pop(listing_id, None)
+                    if not postings:
+                        del self._delta_postings[term]
+
+    def compact(self, path=None):
+        """Fold the delta into a new base file and reload it"""
+        path = path or self.path
+        with self._lock:
+            base_weights = {}
+            for t, term in enumerate(self.terms):
+                for i in range(self._offsets[t], self._offsets[t + 1]):
+                    base_weights.setdefault(self._docs[i], {})[term] = self._tfs[i]
+
+            entries = [
+                (listing_id, base_weights.get(doc, {}), self._doc_len[doc], self._boosts[doc], self.display[doc],
+                 self._digests[doc])
+                for doc, listing_id in enumerate(self.ids) if doc not in self._tombstones
+            ]
+            entries.extend((listing_id, *entry) for listing_id, entry in self._delta.items())
+            count = write_index(path, entries)
+            self.__init__(path)
+        return count
+
+    # Querying
+
+    def _expand(self, token):
+        """[(term, weight)] for a query token: exact, prefix and one-typo matches"""
+        vocab = self.terms
+        expansions = {}
+
+        def known(term):
+            i = bisect.bisect_left(vocab, term)
+            return (i < len(vocab) and vocab[i] == term) or term in self._delta_postings
+
+        if known(token):
+            expansions[token] = 1.0
+        if len(token) >= 3:
+            i = bisect.bisect_left(vocab, token)
+            while i < len(vocab) and vocab[i].startswith(token) and len(expansions) < MAX_EXPANSIONS:
+                expansions.setdefault(vocab[i], PREFIX_WEIGHT)
+                i += 1
+            for term in self._delta_postings:
+                if term.startswith(token) and len(expansions) < MAX_EXPANSIONS:
+                    expansions.setdefault(term, PREFIX_WEIGHT)
+        if not expansions and len(token) >= 4:
+            for candidate in _edits1(token):
+                if known(candidate):
+                    expansions[candidate] = TYPO_WEIGHT
+        return list(expansions.items())
+
+    def _postings(self, term):
+        i = bisect.bisect_left(self.terms, term)
+        if i < len(self.terms) and self.terms[i] == term:
+            return self._offsets[i], self._offsets[i + 1]
+        return 0, 0
+
+    def search(self, query, limit=5):
+        """Top listings for a free-text query, best first"""
+        tokens = [t for t in tokenize(query) if t not in STOPWORDS]
+        if not tokens:
+            return []
+
+        with self._lock:
+            n_base = len(self.ids)
+            n_docs = n_base - len(self._tombstones) + len(self._delta)
+            if not n_docs:
+                return []
+            total_len = sum(self._doc_len) if self._np is None else float(self._np['doc_len'].sum())
+            total_len += sum(entry[1] for entry in self._delta.values())
+            avg_len = total_len / n_docs or 1.0
+
+            base_scores = self._np_zeros(n_base)
+            delta_scores = {}
+            for token in tokens:
+                token_base = self._np_zeros(n_base)
+                token_delta = {}
+                for term, weight in self._expand(token):
+                    start, end = self._postings(term)
+                    delta_postings = self._delta_postings.get(term, {})
+                    df = (end - start) + len(delta_postings)
+                    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5)) * weight
+                    self._score_base(token_base, start, end, idf, avg_len)
+                    for listing_id, tf in delta_postings.items():
+                        length = self._delta[listing_id][1]
+                        score = idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_len))
+                        token_delta[listing_id] = max(token_delta.get(listing_id, 0.0), score)
+                base_scores = base_scores + token_base if self._np else \
+                    [a + b for a, b in zip(base_scores, token_base)]
+                for listing_id, score in token_delta.items():
+                    delta_scores[listing_id] = delta_scores.get(listing_id, 0.0) + score
+
+            return self._top(base_scores, delta_scores, limit)
+
+    def _np_zeros(self, n):
+        if self._np:
+            import numpy as np
+            return np.zeros(n, dtype=np.float32)
+        return [0.0] * n
+
+    def _score_base(self, scores, start, end, idf, avg_len):
+        """Per-document max of this term's BM25 contribution into `scores`"""
+        if start == end:
+            return
+        if self._np:
+            import numpy as np
+            docs = self._np['docs'][start:end]
+            tf = self._np['tfs'][start:end]
+            length = self._np['doc_len'][docs]
+            contribution = idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_len))
+            scores[docs] = np.maximum(scores[docs], contribution)
+            return
+        for i in range(start, end):
+            doc, tf = self._docs[i], self._tfs[i]
+            score = idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * self._doc_len[doc] / avg_len))
+            if score > scores[doc]:
+                scores[doc] = score
+
+    def _top(self, base_scores, delta_scores, limit):
+        candidates = []
+        if self._np and len(base_scores):
+            import numpy as np
+            scores = base_scores * self._np['boosts']
+            if self._tombstones:
+                scores[list(self._tombstones)] = 0
+            hits = np.flatnonzero(scores)
+            if len(hits) > limit:
+                hits = hits[np.argpartition(scores[hits], -limit)[-limit:]]
+            candidates = [(float(scores[doc]), self.ids[doc], self.display[doc]) for doc in hits]
+        else:
+            for doc, score in enumerate(base_scores):
+                if score and doc not in self._tombstones:
+                    candidates.append((score * self._boosts[doc], self.ids[doc], self.display[doc]))
+        for listing_id, score in delta_scores.items():
+            _, _, boost, display, _ = self._delta[listing_id]
+            candidates.append((score * boost, listing_id, display))
+
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        return [{'id': listing_id, 'score': round(score, 4), **dict(zip(DISPLAY_FIELDS, display))}
+                for score, listing_id, display in candidates[:limit]]
+
+    def __len__(self):
+        return len(self.ids) - len(self._tombstones) + len(self._delta)
+
+    @property
+    def pending(self):
+        """Listings in the delta, waiting for compact()"""
+        return len(self._delta)
+
+
+def build_from_firestore(path=INDEX_PATH, db=None):
+    """Write a fresh index of every active listing"""
+    db = db or services.get_db()
+    entries = (index_entry(doc.id, doc.to_dict())
+               for doc in db.collection('listings').stream() if _is_live(doc.to_dict()))
+    return write_index(path, entries)
+
+
+def _is_live(listing):
+    return listing.get('status', 'active') not in ('under_review', 'removed', 'expired')
+
+
+def attach_listener(index, db=None, compact_after=COMPACT_AFTER):
+    """Keep `index` current from Firestore's listings snapshot listener
+
+    Compacts the index into its file once `compact_after` listings have
+    changed. Returns the watch handle; call .unsubscribe() to stop.
+    """
+    db = db or services.get_db()
+
+    def on_change(snapshots, changes, read_time):
+        for change in changes:
+            doc = change.document
+            if change.type.name == 'REMOVED' or not _is_live(doc.to_dict() or {}):
+                index.remove(doc.id)
+            else:
+                index.upsert(doc.id, doc.to_dict())
+        if index.path and index.pending >= compact_after:
+            count = index.compact()
+            print(f"🗂️ Compacted listing index: {count} listings in {index.path}")
+
+    return db.collection('listings').on_snapshot(on_change)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index(path=INDEX_PATH):
+    """Shared index, memory-mapped on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                try:
+                    _index = SearchIndex(path)
+                except ValueError as e:
+                    # Old format: the listener's initial snapshot rebuilds it
+                    print(f"⚠️ Ignoring listing index: {e}")
+                    _index = SearchIndex()
+                    _index.path = path
+    return _index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Listing search index")
+    parser.add_argument('--build', action='store_true', help="Rebuild the index from Firestore")
+    parser.add_argument('--path', default=INDEX_PATH)
+    parser.add_argument('query', nargs='*')
+    args = parser.parse_args()
+
+    if args.build:
+        print(f"✅ Indexed {build_from_firestore(args.path)} listings to {args.path}")
+    if args.query:
+        for hit in SearchIndex(args.path).search(" ".join(args.query)):
+            print(f"{hit['score']:>8}  {hit['business_name']} ({hit['category']}, {hit['town']})")
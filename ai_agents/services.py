@@ -0,0 +1,111 @@
+import os
+import threading
+
+# Shared, once-only service registry.
+#
+# Agents never create Firebase apps or cloud clients at import time. They ask
+# the registry for a named service and the first caller pays the cost of
+# importing and building it; everyone after that gets the same instance.
+
+_lock = threading.RLock()
+_factories = {}
+_instances = {}
+
+
+def register(name, factory):
+    """Register a zero-argument factory for a named service"""
+    with _lock:
+        _factories[name] = factory
+
+
+def get(name):
+    """Return the named service, building it on first use"""
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+
+    with _lock:
+        if name not in _instances:
+            if name not in _factories:
+                raise KeyError(f"Unknown service: {name}")
+            _instances[name] = _factories[name]()
+        return _instances[name]
+
+
+def provide(name, instance):
+    """Install a ready-made instance (used by local fakes and benchmarks)"""
+    with _lock:
+        _instances[name] = instance
+
+
+def reset(name=None):
+    """Forget a built instance (or all of them) so the next get() rebuilds"""
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+
+def is_loaded(name):
+    """True if the named service has already been built"""
+    return name in _instances
+
+
+class LazyService:
+    """Module-level stand-in that resolves to a registry service on first use
+
+    Lets agent modules keep writing `db.collection(...)` without touching
+    Firebase when they are imported.
+    """
+
+    __slots__ = ('_name',)
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get(self._name), attr)
+
+    def __repr__(self):
+        return f"<LazyService {self._name}>"
+
+
+# Default factories
+
+def _firebase_app():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    try:
+        return firebase_admin.get_app()
+    except ValueError:
+        cred = credentials.Certificate(os.getenv('FIREBASE_KEY_PATH', 'firebase-key.json'))
+        return firebase_admin.initialize_app(cred)
+
+
+def _firestore():
+    from firebase_admin import firestore
+    return firestore.client(get('firebase_app'))
+
+
+def _storage_bucket():
+    from google.cloud import storage
+    return storage.Client().bucket(os.getenv('GCS_BUCKET_NAME'))
+
+
+def _vision():
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient()
+
+
+register('firebase_app', _firebase_app)
+register('firestore', _firestore)
+register('storage_bucket', _storage_bucket)
+register('vision', _vision)
+
+
+def get_db():
+    """Shared Firestore client"""
+    return get('firestore')
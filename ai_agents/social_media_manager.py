@@ -3,17 +3,14 @@ import random
 import time
 import json
 import requests
-import firebase_admin
-from firebase_admin import firestore, credentials
 from datetime import datetime, timedelta
-from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 import textwrap
 
-# Initialize Firebase
-cred = credentials.Certificate('firebase-key.json')
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+from . import listing_cache, metrics, services
+
+# Firestore is resolved on first use, not at import
+db = services.LazyService('firestore')
 
 class SocialMediaManager:
     def __init__(self):
@@ -59,7 +56,9 @@ class SocialMediaManager:
             .where('last_featured', '<', datetime.utcnow() - timedelta(days=7))\
             .limit(20)
         
-        paid_businesses = [doc.to_dict() for doc in paid_ref.stream()]
+        # Cached, so renewing or paying for the featured listing later is not a fresh read
+        cache = listing_cache.get_cache()
+        paid_businesses = cache.prime('listings', paid_ref.stream())
         
         if paid_businesses:
             return random.choice(paid_businesses)
@@ -69,7 +68,7 @@ class SocialMediaManager:
             .where('last_featured', '<', datetime.utcnow() - timedelta(days=30))\
             .limit(50)
         
-        free_businesses = [doc.to_dict() for doc in free_ref.stream()]
+        free_businesses = cache.prime('listings', free_ref.stream())
         return random.choice(free_businesses) if free_businesses else None
     
     def generate_caption(self, business):
@@ -96,6 +95,8 @@ class SocialMediaManager:
     
     def create_image(self, business):
         """Create social media image"""
+        from PIL import Image, ImageDraw, ImageFont
+
         # Create base image
         img = Image.new('RGB', (1200, 630), color=(35, 35, 60))
         draw = ImageDraw.Draw(img)
@@ -146,6 +147,7 @@ class SocialMediaManager:
         if self.platforms['instagram']['access_token']:
             self.post_to_instagram(text, image)
     
+    @metrics.timed('social_post', platform='facebook')
     def post_to_facebook(self, text, image):
         """Post to Facebook Page"""
         url = f"https://graph.facebook.com/{self.platforms['facebook']['page_id']}/photos"
@@ -157,6 +159,7 @@ class SocialMediaManager:
         
         try:
             response = requests.post(url, files=files, data=data)
+            metrics.counter('social_posts_total', "Social media posts").inc(platform='facebook', status=response.status_code)
             if response.status_code == 200:
                 print("✅ Posted to Facebook")
             else:
@@ -164,6 +167,7 @@ class SocialMediaManager:
         except Exception as e:
             print(f"Facebook error: {str(e)}")
     
+    @metrics.timed('social_post', platform='twitter')
     def post_to_twitter(self, text, image):
         """Post to Twitter"""
         # Twitter API v2 requires media upload first
@@ -182,6 +186,7 @@ class SocialMediaManager:
                 tweet_data = {"text": text, "media": {"media_ids": [media_id]}}
                 response = requests.post(tweet_url, json=tweet_data, headers=headers)
                 
+                metrics.counter('social_posts_total', "Social media posts").inc(platform='twitter', status=response.status_code)
                 if response.status_code == 201:
                     print("✅ Posted to Twitter")
                 else:
@@ -189,6 +194,7 @@ class SocialMediaManager:
         except Exception as e:
             print(f"Twitter error: {str(e)}")
     
+    @metrics.timed('social_post', platform='instagram')
     def post_to_instagram(self, text, image):
         """Post to Instagram"""
         # Instagram requires Facebook page connection
@@ -234,6 +240,14 @@ class SocialMediaManager:
                 print(f"Social media error: {str(e)}")
                 time.sleep(3600)  # Retry after 1 hour
 
+def post_content():
+    """Create and publish a single featured-business post"""
+    smm = SocialMediaManager()
+    content = smm.create_content()
+    if content:
+        text, image = content
+        smm.post_to_platforms(text, image)
+
 if __name__ == "__main__":
     smm = SocialMediaManager()
     smm.run()
@@ -0,0 +1,287 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+# Compact tokenizer for the moderation model.
+#
+# Drop-in for the Keras Tokenizer + pad_sequences pair that ContentModerator
+# used: same text splitting, same word ids (the vocab_size - 1 most frequent
+# words, ranked as Keras ranks them), and the same 'pre' padding and
+# truncation, so an already trained model keeps working. Only the frozen
+# vocabulary is kept, as a sorted array of 64-bit word keys with a parallel
+# array of ids. The file is the two arrays behind a small JSON header and is
+# memory-mapped, so loading copies nothing and several processes share the
+# pages.
+#
+# encode() never builds a Python string per word. The batch is joined,
+# lowercased and filtered as one string, and word boundaries are found in
+# its UTF-8 bytes with NumPy. Each word's key is a polynomial hash computed
+# from prefix sums. The keys are looked up with one searchsorted, and the
+# ids are scattered straight into a padded int32 matrix.
+#
+# mode='hash' skips the vocabulary (hashing trick): id = 1 + key % (vocab_size
+# - 1). A model has to be trained in that mode to use it.
+#
+# File layout (little-endian):
+#   8s   magic
+#   u32  header length, then the JSON header
+#   pad to 8 bytes
+#   u64[n]  word keys, ascending
+#   i32[n]  word ids
+
+MAGIC = b'FSDTOK01'
+
+# Keras Tokenizer defaults
+FILTERS = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+SPLIT = ' '
+
+# Word keys: sum((byte + 1) * BASE**i) mod 2**64, plus the length times LENGTH_MIX
+BASE = 0x100000001B3
+LENGTH_MIX = 0x9E3779B97F4A7C15
+_MASK = 2 ** 64 - 1
+
+# Joins a batch into one string; NUL never survives as part of a word
+SEPARATOR = '\x00'
+
+_powers = None
+_powers_lock = threading.Lock()
+
+
+def word_key(word):
+    """64-bit key for a word; encode() computes the same value vectorised"""
+    data = word.encode('utf-8')
+    key, power = 0, 1
+    for byte in data:
+        key = (key + (byte + 1) * power) & _MASK
+        power = (power * BASE) & _MASK
+    return (key + len(data) * LENGTH_MIX) & _MASK
+
+
+def _power_tables(n):
+    """BASE**i and BASE**-i mod 2**64 for i < n (grown and shared across calls)"""
+    import numpy as np
+
+    global _powers
+    tables = _powers
+    if tables is None or len(tables[0]) < n:
+        with _powers_lock:
+            tables = _powers
+            if tables is None or len(tables[0]) < n:
+                size = max(n, 2 * len(tables[0]) if tables else 1 << 16)
+                inverse = pow(BASE, -1, 2 ** 64)
+                # uint64 products wrap, which is exactly mod 2**64
+                forward = np.full(size, BASE, dtype=np.uint64)
+                backward = np.full(size, inverse, dtype=np.uint64)
+                forward[0] = backward[0] = 1
+                tables = _powers = (np.cumprod(forward), np.cumprod(backward))
+    return tables
+
+
+class CompactTokenizer:
+    """Frozen-vocabulary (or hashing) tokenizer with batch encoding into padded int32 arrays"""
+
+    def __init__(self, max_len=100, vocab_size=10000, mode='vocab', filters=FILTERS, lower=True, split=SPLIT):
+        import numpy as np
+
+        if mode not in ('vocab', 'hash'):
+            raise ValueError(f"Unknown tokenizer mode: {mode}")
+        self.max_len = max_len
+        self.vocab_size = vocab_size
+        self.mode = mode
+        self.filters = filters
+        self.lower = lower
+        self.split = split
+        self._table = str.maketrans({c: split for c in filters})
+        # Byte-level splitting works for any single ASCII split character
+        self._split_byte = ord(split) if len(split) == 1 and split.isascii() and split != SEPARATOR else None
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._ids = np.zeros(0, dtype=np.int32)
+        self._mmap = None
+
+    # Building
+
+    def fit_on_texts(self, texts):
+        """Freeze the vocabulary from training texts, ranking words like Keras"""
+        counts = OrderedDict()
+        for text in texts:
+            for word in self.split_text(text):
+                counts[word] = counts.get(word, 0) + 1
+        # Stable sort: ties keep first-seen order, as in Keras
+        ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        self._set_vocab(word for word, _ in ranked[:self.vocab_size - 1])
+        return self
+
+    @classmethod
+    def from_keras(cls, keras_tokenizer, max_len=100, vocab_size=None):
+        """Freeze an existing (pickled) Keras Tokenizer, keeping its word ids"""
+        vocab_size = vocab_size or keras_tokenizer.num_words or len(keras_tokenizer.word_index) + 1
+        tokenizer = cls(max_len, vocab_size, filters=keras_tokenizer.filters,
+                        lower=keras_tokenizer.lower, split=keras_tokenizer.split)
+        if keras_tokenizer.oov_token is not None:
+            raise ValueError("Tokenizers with an oov_token are not supported")
+        ranked = sorted(keras_tokenizer.word_index.items(), key=lambda item: item[1])
+        tokenizer._set_vocab(word for word, index in ranked if index < vocab_size)
+        return tokenizer
+
+    def _set_vocab(self, words):
+        import numpy as np
+
+        words = list(words)
+        keys = np.fromiter((word_key(w) for w in words), dtype=np.uint64, count=len(words))
+        ids = np.arange(1, len(words) + 1, dtype=np.int32)
+        order = np.argsort(keys, kind='stable')
+        self._keys, self._ids = keys[order], ids[order]
+        if len(self._keys) > 1 and (self._keys[1:] == self._keys[:-1]).any():
+            raise ValueError("Word key collision in vocabulary")
+
+    # Encoding
+
+    def split_text(self, text):
+        """Keras text_to_word_sequence"""
+        if self.lower:
+            text = text.lower()
+        return [word for word in text.translate(self._table).split(self.split) if word]
+
+    def encode(self, texts, out=None):
+        """Padded (len(texts), max_len) int32 ids; writes into `out` if given
+
+        Matches texts_to_sequences + pad_sequences(maxlen=max_len): unknown
+        words are dropped, then sequences are left-padded with 0 and long
+        ones keep their last max_len words.
+        """
+        import numpy as np
+
+        rows = len(texts)
+        if out is None:
+            out = np.zeros((rows, self.max_len), dtype=np.int32)
+        else:
+            if out.shape[0] < rows or out.shape[1] != self.max_len or out.dtype != np.int32:
+                raise ValueError(f"out must be int32 with shape (>= {rows}, {self.max_len})")
+            out = out[:rows]
+            out.fill(0)
+        if not rows:
+            return out
+
+        keys, row = self._batch_keys(texts)
+        ids = self._lookup(keys)
+        known = ids > 0
+        ids, row = ids[known], row[known]
+
+        # Position of each kept word from the end of its row
+        kept = np.bincount(row, minlength=rows)
+        ends = np.cumsum(kept)
+        from_end = ends[row] - np.arange(len(ids)) - 1
+        fits = from_end < self.max_len
+        out[row[fits], self.max_len - 1 - from_end[fits]] = ids[fits]
+        return out
+
+    def _batch_keys(self, texts):
+        """(word keys, row of each word) for a batch, in order"""
+        import numpy as np
+
+        joined = SEPARATOR.join(texts)
+        if self.lower:
+            joined = joined.lower()
+        joined = joined.translate(self._table)
+        data = np.frombuffer(joined.encode('utf-8'), dtype=np.uint8)
+        separators = data == 0
+        if self._split_byte is None or int(separators.sum()) != len(texts) - 1:
+            # Multi-character split, or NULs inside the texts themselves
+            words = [self.split_text(text) for text in texts]
+            lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(texts))
+            flat = [word for text_words in words for word in text_words]
+            return (np.fromiter(map(word_key, flat), dtype=np.uint64, count=len(flat)),
+                    np.repeat(np.arange(len(texts)), lengths))
+
+        # Word boundaries: runs of bytes that are neither the split byte nor NUL
+        inside = np.empty(len(data) + 2, dtype=np.int8)
+        inside[0] = inside[-1] = 0
+        np.not_equal(data, self._split_byte, out=inside[1:-1].view(bool))
+        inside[1:-1] &= ~separators
+        edges = np.diff(inside)
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+
+        forward, backward = _power_tables(len(data))
+        prefix = np.empty(len(data) + 1, dtype=np.uint64)
+        prefix[0] = 0
+        np.cumsum((data + np.uint64(1)) * forward[:len(data)], out=prefix[1:])
+        keys = (prefix[ends] - prefix[starts]) * backward[starts]
+        keys += (ends - starts).astype(np.uint64) * np.uint64(LENGTH_MIX)
+        return keys, np.cumsum(separators)[starts]
+
+    def _lookup(self, keys):
+        import numpy as np
+
+        if self.mode == 'hash':
+            return (keys % np.uint64(self.vocab_size - 1)).astype(np.int32) + 1
+        if not len(self._keys):
+            return np.zeros(len(keys), dtype=np.int32)
+        pos = np.searchsorted(self._keys, keys)
+        pos[pos == len(self._keys)] = 0
+        return np.where(self._keys[pos] == keys, self._ids[pos], 0).astype(np.int32)
+
+    def __len__(self):
+        return len(self._keys)
+
+    # Serialization
+
+    def save(self, path):
+        header = json.dumps({
+            'mode': self.mode, 'max_len': self.max_len, 'vocab_size': self.vocab_size,
+            'filters': self.filters, 'lower': self.lower, 'split': self.split, 'words': len(self._keys),
+        }).encode()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            f.write(b'\0' * (-(len(MAGIC) + 4 + len(header)) % 8))
+            f.write(self._keys.astype('<u8').tobytes())
+            f.write(self._ids.astype('<i4').tobytes())
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a saved tokenizer; the arrays are views over the file"""
+        import numpy as np
+
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a tokenizer file: {path}")
+        (header_len,) = struct.unpack_from('<I', mapped, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(mapped[start:start + header_len])
+        offset = start + header_len
+        offset += -offset % 8
+
+        tokenizer = cls(header['max_len'], header['vocab_size'], header['mode'],
+                        header['filters'], header['lower'], header['split'])
+        n = header['words']
+        tokenizer._keys = np.frombuffer(mapped, dtype='<u8', count=n, offset=offset)
+        tokenizer._ids = np.frombuffer(mapped, dtype='<i4', count=n, offset=offset + 8 * n)
+        tokenizer._mmap = mapped
+        return tokenizer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a pickled Keras tokenizer to the compact format")
+    parser.add_argument('keras_pickle')
+    parser.add_argument('output')
+    parser.add_argument('--max-len', type=int, default=100)
+    parser.add_argument('--vocab-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    import pickle
+
+    with open(args.keras_pickle, 'rb') as f:
+        keras_tokenizer = pickle.load(f)
+    tokenizer = CompactTokenizer.from_keras(keras_tokenizer, args.max_len, args.vocab_size)
+    tokenizer.save(args.output)
+    print(f"✅ Wrote {len(tokenizer)} words to {args.output}")
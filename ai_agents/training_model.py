@@ -1,26 +1,18 @@
+import argparse
 import os
-import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import Sequential, load_model
-from tensorflow.keras.layers import Dense, Embedding, LSTM, Dropout, Bidirectional
-from tensorflow.keras.preprocessing.text import Tokenizer
-from tensorflow.keras.preprocessing.sequence import pad_sequences
-from sklearn.model_selection import train_test_split
-from google.cloud import storage
-import firebase_admin
-from firebase_admin import firestore, credentials
+import time
 import pickle
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 
-# Initialize Firebase
-cred = credentials.Certificate('firebase-key.json')
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+from . import listing_cache, metrics, services
+from .tokenizer import CompactTokenizer
 
-# Initialize Cloud Storage
-storage_client = storage.Client()
-bucket = storage_client.bucket(os.getenv('GCS_BUCKET_NAME'))
+# Firestore and Cloud Storage are resolved on first use, not at import.
+# TensorFlow, NumPy and scikit-learn are imported inside the methods that
+# need them so that importing this module stays cheap.
+db = services.LazyService('firestore')
+bucket = services.LazyService('storage_bucket')
 
 class ContentModerator:
     def __init__(self):
@@ -28,28 +20,45 @@ class ContentModerator:
         self.tokenizer = None
         self.max_len = 100
         self.vocab_size = 10000
+        self._row = None  # reused input buffer for single predictions
         self.load_model()
     
     def load_model(self):
         """Load model from storage or initialize"""
+        from tensorflow.keras.models import load_model
+
         try:
             # Try to load from Cloud Storage
             model_blob = bucket.blob("models/moderation_model.h5")
             model_blob.download_to_filename("local_model.h5")
             self.model = load_model("local_model.h5")
             
-            tokenizer_blob = bucket.blob("models/tokenizer.pkl")
-            tokenizer_blob.download_to_filename("local_tokenizer.pkl")
-            with open("local_tokenizer.pkl", "rb") as f:
-                self.tokenizer = pickle.load(f)
+            self.tokenizer = self.load_tokenizer()
                 
             print("✅ Loaded existing moderation model")
         except:
             print("⚠️ No model found, initializing new model")
             self.initialize_model()
     
+    def load_tokenizer(self):
+        """Memory-map the compact tokenizer, converting a legacy Keras pickle once"""
+        tokenizer_blob = bucket.blob("models/tokenizer.bin")
+        if tokenizer_blob.exists():
+            tokenizer_blob.download_to_filename("local_tokenizer.bin")
+        else:
+            legacy_blob = bucket.blob("models/tokenizer.pkl")
+            legacy_blob.download_to_filename("local_tokenizer.pkl")
+            with open("local_tokenizer.pkl", "rb") as f:
+                keras_tokenizer = pickle.load(f)
+            CompactTokenizer.from_keras(keras_tokenizer, self.max_len, self.vocab_size).save("local_tokenizer.bin")
+            tokenizer_blob.upload_from_filename("local_tokenizer.bin")
+        return CompactTokenizer.load("local_tokenizer.bin")
+
     def initialize_model(self):
         """Initialize a new model"""
+        from tensorflow.keras.models import Sequential
+        from tensorflow.keras.layers import Dense, Embedding, LSTM, Dropout, Bidirectional
+
         self.model = Sequential([
             Embedding(self.vocab_size, 128, input_length=self.max_len),
             Bidirectional(LSTM(64, return_sequences=True)),
@@ -65,11 +74,13 @@ class ContentModerator:
             metrics=['accuracy']
         )
         
-        self.tokenizer = Tokenizer(num_words=self.vocab_size)
+        self.tokenizer = CompactTokenizer(self.max_len, self.vocab_size)
         print("✅ Initialized new moderation model")
     
     def load_data(self):
         """Load training data from Firestore"""
+        import numpy as np
+
         scam_ref = db.collection('scam_reports').where('confirmed', '==', True)
         legit_ref = db.collection('listings').where('reported', '==', False).limit(1000)
         
@@ -93,10 +104,11 @@ class ContentModerator:
     
     def preprocess_data(self, texts, labels):
         """Prepare data for training"""
+        from sklearn.model_selection import train_test_split
+
         # Tokenize text
         self.tokenizer.fit_on_texts(texts)
-        sequences = self.tokenizer.texts_to_sequences(texts)
-        padded = pad_sequences(sequences, maxlen=self.max_len)
+        padded = self.tokenizer.encode(texts)
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(
@@ -105,7 +117,7 @@ class ContentModerator:
         
         return X_train, X_test, y_train, y_test
     
-    def train(self, X_train, y_train, X_test, y_test):
+    def train(self, X_train, y_train, X_test, y_test, upload=True):
         """Train the model"""
         history = self.model.fit(
             X_train, y_train,
@@ -117,32 +129,52 @@ class ContentModerator:
         
         # Save model
         self.model.save("local_model.h5")
-        with open("local_tokenizer.pkl", "wb") as f:
-            pickle.dump(self.tokenizer, f)
+        self.tokenizer.save("local_tokenizer.bin")
         
         # Upload to Cloud Storage
-        model_blob = bucket.blob("models/moderation_model.h5")
-        model_blob.upload_from_filename("local_model.h5")
-        
-        tokenizer_blob = bucket.blob("models/tokenizer.pkl")
-        tokenizer_blob.upload_from_filename("local_tokenizer.pkl")
+        if upload:
+            model_blob = bucket.blob("models/moderation_model.h5")
+            model_blob.upload_from_filename("local_model.h5")
+
+            tokenizer_blob = bucket.blob("models/tokenizer.bin")
+            tokenizer_blob.upload_from_filename("local_tokenizer.bin")
         
         print("✅ Model trained and saved")
         return history
     
+    @metrics.timed('moderation_predict')
     def predict(self, text):
         """Predict if content is scam"""
-        sequence = self.tokenizer.texts_to_sequences([text])
-        padded = pad_sequences(sequence, maxlen=self.max_len)
+        import numpy as np
+
+        if self._row is None:
+            self._row = np.zeros((1, self.max_len), dtype=np.int32)
+        padded = self.tokenizer.encode([text], out=self._row)
         prediction = self.model.predict(padded)
         return prediction[0][0]
+
+    def predict_batch(self, texts, batch_size=256):
+        """Scam scores for many texts, encoded into one reused int32 buffer"""
+        import numpy as np
+
+        buffer = np.zeros((min(batch_size, len(texts)), self.max_len), dtype=np.int32)
+        scores = []
+        for start in range(0, len(texts), batch_size):
+            padded = self.tokenizer.encode(texts[start:start + batch_size], out=buffer)
+            scores.extend(self.model.predict(padded, batch_size=batch_size)[:, 0])
+        return scores
     
     def moderate_content(self, text, threshold=0.7):
         """Moderate text content"""
         scam_score = self.predict(text)
         return scam_score > threshold
+
+    @metrics.timed('moderation_predict_batch')
+    def moderate_batch(self, texts, threshold=0.7):
+        """moderate_content for many texts in batched model calls"""
+        return [score > threshold for score in self.predict_batch(texts)]
     
-    def retrain(self):
+    def retrain(self, upload=True):
         """Retrain the model with new data"""
         print("🔁 Retraining moderation model...")
         texts, labels = self.load_data()
@@ -152,7 +184,7 @@ class ContentModerator:
             return
             
         X_train, X_test, y_train, y_test = self.preprocess_data(texts, labels)
-        self.train(X_train, y_train, X_test, y_test)
+        self.train(X_train, y_train, X_test, y_test, upload=upload)
         print("✅ Retraining complete")
 
 class ModelTrainer:
@@ -167,21 +199,24 @@ class ModelTrainer:
             .where('created_at', '>', datetime.utcnow() - timedelta(days=1))\
             .stream()
         
-        for listing in new_listings:
-            data = listing.to_dict()
-            text = f"{data.get('business_name', '')} {data.get('description', '')}"
-            
-            if self.moderator.moderate_content(text):
-                print(f"🚫 Flagged listing {listing.id}")
+        cache = listing_cache.get_cache()
+        listings = [(listing.id, listing.to_dict()) for listing in new_listings]
+        # Score the whole day's content in batches, not one model call per item
+        flags = self.moderator.moderate_batch(
+            [f"{data.get('business_name', '')} {data.get('description', '')}" for _, data in listings]
+        )
+        for (listing_id, data), flagged in zip(listings, flags):
+            metrics.counter('moderation_items_total', "Items moderated").inc(kind='listing', flagged=flagged)
+            if flagged:
+                print(f"🚫 Flagged listing {listing_id}")
                 # Mark for review
-                db.collection('listings').document(listing.id).update({
-                    'status': 'under_review',
-                    'moderated': True
-                })
+                changes = {'status': 'under_review', 'moderated': True}
             else:
-                db.collection('listings').document(listing.id).update({
-                    'moderated': True
-                })
+                changes = {'moderated': True}
+            with metrics.span('firestore_update', collection='listings'):
+                db.collection('listings').document(listing_id).update(changes)
+            # Write through, so other agents read the moderated listing without a fetch
+            cache.put('listings', listing_id, {**data, **changes})
         
         # Check user reviews
         new_reviews = db.collection('reviews')\
@@ -189,18 +224,21 @@ class ModelTrainer:
             .where('created_at', '>', datetime.utcnow() - timedelta(days=1))\
             .stream()
         
-        for review in new_reviews:
-            data = review.to_dict()
-            if self.moderator.moderate_content(data['content']):
-                print(f"🚫 Flagged review {review.id}")
-                db.collection('reviews').document(review.id).update({
-                    'status': 'removed',
-                    'moderated': True
-                })
-            else:
-                db.collection('reviews').document(review.id).update({
-                    'moderated': True
-                })
+        reviews = [(review.id, review.to_dict()) for review in new_reviews]
+        flags = self.moderator.moderate_batch([data['content'] for _, data in reviews])
+        for (review_id, data), flagged in zip(reviews, flags):
+            metrics.counter('moderation_items_total', "Items moderated").inc(kind='review', flagged=flagged)
+            with metrics.span('firestore_update', collection='reviews'):
+                if flagged:
+                    print(f"🚫 Flagged review {review_id}")
+                    db.collection('reviews').document(review_id).update({
+                        'status': 'removed',
+                        'moderated': True
+                    })
+                else:
+                    db.collection('reviews').document(review_id).update({
+                        'moderated': True
+                    })
     
     def run(self):
         """Main run loop"""
@@ -220,5 +258,13 @@ class ModelTrainer:
                 time.sleep(3600)  # Retry after 1 hour
 
 if __name__ == "__main__":
-    trainer = ModelTrainer()
-    trainer.run()
+    parser = argparse.ArgumentParser(description="Daily moderation and model retraining")
+    parser.add_argument('--retrain', action='store_true', help="Retrain the moderation model once and exit")
+    parser.add_argument('--upload', action='store_true', help="With --retrain, publish the model to Cloud Storage")
+    args = parser.parse_args()
+
+    if args.retrain:
+        ContentModerator().retrain(upload=args.upload)
+    else:
+        trainer = ModelTrainer()
+        trainer.run()
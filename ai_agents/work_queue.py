@@ -0,0 +1,203 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Durable, deduplicating work queue backed by SQLite.
+#
+# Items are keyed: putting a key that is already known (pending, leased or
+# done) is a no-op, which is what makes webhook retries and re-discovered
+# crawl URLs harmless. Consumers claim items under a time-limited lease; if a
+# worker dies, the lease expires and another worker picks the item up.
+#
+# Done items are kept for deduplication until purge() drops them, so owners
+# of long-lived queues should purge on a schedule with a retention longer
+# than any producer's retry window. synchronous='FULL' makes every commit
+# survive power loss, for queues whose producers are told "received" as
+# soon as put() returns.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_items (
+    queue        TEXT NOT NULL,
+    key          TEXT NOT NULL,
+    seq          INTEGER NOT NULL,
+    payload      TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    owner        TEXT,
+    lease_until  REAL NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    updated_at   REAL NOT NULL,
+    error        TEXT,
+    PRIMARY KEY (queue, key)
+);
+CREATE INDEX IF NOT EXISTS queue_items_claim
+    ON queue_items (queue, status, available_at, seq);
+CREATE INDEX IF NOT EXISTS queue_items_seq
+    ON queue_items (queue, seq);
+"""
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+DEAD = 'dead'
+
+
+class WorkQueue:
+    """Named queue inside a SQLite file; safe to share across threads and processes"""
+
+    def __init__(self, path, name='default', lease_seconds=60, max_attempts=5, synchronous='NORMAL'):
+        if synchronous not in ('NORMAL', 'FULL'):
+            raise ValueError(f"Unsupported synchronous mode: {synchronous}")
+        self.path = path
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.synchronous = synchronous
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={self.synchronous}')
+            self._local.conn = conn
+        return conn
+
+    def _write(self, sql_batches):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            results = [conn.execute(sql, params) for sql, params in sql_batches]
+            conn.execute('COMMIT')
+            return results
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def put(self, key, payload, delay=0):
+        """Enqueue payload under key; False if the key was already seen"""
+        return self.put_many([(key, payload)], delay) == 1
+
+    def put_many(self, items, delay=0):
+        """Enqueue (key, payload) pairs; returns how many were new"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM queue_items WHERE queue = ?',
+                               (self.name,)).fetchone()[0]
+            added = 0
+            for key, payload in items:
+                seq += 1
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO queue_items (queue, key, seq, payload, available_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (self.name, str(key), seq, json.dumps(payload, default=str), now + delay, now)
+                )
+                added += cursor.rowcount
+            conn.execute('COMMIT')
+            return added
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def claim(self, limit=1, owner=None, lease_seconds=None):
+        """Lease up to `limit` ready items; returns [(key, payload)]"""
+        owner = owner or uuid.uuid4().hex
+        now = time.time()
+        lease_until = now + (lease_seconds or self.lease_seconds)
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                'SELECT key, payload FROM queue_items WHERE queue = ? AND available_at <= ? '
+                'AND (status = ? OR (status = ? AND lease_until < ?)) ORDER BY seq LIMIT ?',
+                (self.name, now, PENDING, LEASED, now, limit)
+            ).fetchall()
+            conn.executemany(
+                'UPDATE queue_items SET status = ?, owner = ?, lease_until = ?, attempts = attempts + 1, '
+                'updated_at = ? WHERE queue = ? AND key = ?',
+                [(LEASED, owner, lease_until, now, self.name, key) for key, _ in rows]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [(key, json.loads(payload)) for key, payload in rows]
+
+    def ack(self, keys):
+        """Mark leased items as done (kept so the key stays deduplicated)"""
+        now = time.time()
+        self._write([
+            ('UPDATE queue_items SET status = ?, lease_until = 0, updated_at = ? WHERE queue = ? AND key = ?',
+             (DONE, now, self.name, str(key))) for key in keys
+        ])
+
+    def fail(self, keys, error=None, backoff=5.0, retry=True):
+        """Return items to the queue with exponential backoff, or park them as dead
+
+        retry=False parks them at once, for items that can never succeed.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for key in keys:
+                row = conn.execute('SELECT attempts FROM queue_items WHERE queue = ? AND key = ?',
+                                   (self.name, str(key))).fetchone()
+                if row is None:
+                    continue
+                attempts = row[0]
+                status = DEAD if not retry or attempts >= self.max_attempts else PENDING
+                conn.execute(
+                    'UPDATE queue_items SET status = ?, lease_until = 0, available_at = ?, error = ?, '
+                    'updated_at = ? WHERE queue = ? AND key = ?',
+                    (status, now + backoff * 2 ** (attempts - 1), error, now, self.name, str(key))
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def extend(self, keys, lease_seconds=None):
+        """Renew the lease on items this worker is still processing"""
+        lease_until = time.time() + (lease_seconds or self.lease_seconds)
+        self._write([
+            ('UPDATE queue_items SET lease_until = ? WHERE queue = ? AND key = ? AND status = ?',
+             (lease_until, self.name, str(key), LEASED)) for key in keys
+        ])
+
+    def status(self, key):
+        row = self._conn().execute('SELECT status FROM queue_items WHERE queue = ? AND key = ?',
+                                   (self.name, str(key))).fetchone()
+        return row[0] if row else None
+
+    def stats(self):
+        """Item counts by status"""
+        rows = self._conn().execute(
+            'SELECT status, COUNT(*) FROM queue_items WHERE queue = ? GROUP BY status', (self.name,)
+        ).fetchall()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, DEAD: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def purge(self, older_than):
+        """Drop done items last touched more than `older_than` seconds ago"""
+        cutoff = time.time() - older_than
+        return self._write([
+            ('DELETE FROM queue_items WHERE queue = ? AND status = ? AND updated_at < ?',
+             (self.name, DONE, cutoff))
+        ])[0].rowcount
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1 @@
+"""Offline benchmark harness for the AI agents (see benchmarks/run.py)."""
@@ -0,0 +1,126 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Synthetic business directory for offline scraper benchmarks.
+#
+# Serves /<region>/page/<n> with `cards` deterministic `.business-card`
+# entries per page and an `a.next` link until `pages` is reached. Any path
+# ending in robots.txt allows everything.
+
+CATEGORIES = ["Plumbers", "Electricians", "Estate Agents", "Auto Electricians", "Repair Shops"]
+TOWNS = ["Bloemfontein", "Botshabelo", "Thaba Nchu", "Welkom", "Bethlehem", "Sasolburg"]
+
+
+def render_card(region, page, index, version=0):
+    seed = int(hashlib.md5(f"{region}:{page}:{index}:{version}".encode()).hexdigest()[:8], 16)
+    town = TOWNS[seed % len(TOWNS)]
+    category = CATEGORIES[seed % len(CATEGORIES)]
+    return (
+        '<div class="business-card">'
+        f'<h3 class="name">{town} {category} {region}-{page}-{index}</h3>'
+        f'<span class="category">{category}</span>'
+        f'<span class="phone">+27{seed % 10**9:09d}</span>'
+        f'<span class="email">info{seed % 10000}@example.co.za</span>'
+        f'<span class="address">{seed % 300} Main Road, {town}</span>'
+        '</div>'
+    )
+
+
+def render_page(region, page, pages, cards, version=0):
+    body = [f"<html><body><h1>{region} businesses - page {page}</h1>"]
+    body.extend(render_card(region, page, i, version) for i in range(cards))
+    if page < pages:
+        body.append(f'<a class="next" href="/{region}/page/{page + 1}">Next</a>')
+    body.append("</body></html>")
+    return "".join(body)
+
+
+class DirectoryServer:
+    """Threaded loopback HTTP server; use as a context manager"""
+
+    def __init__(self, pages=20, cards=25, port=0):
+        self.pages = pages
+        self.cards = cards
+        # Bump to change page content (simulates directory churn)
+        self.versions = {}
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.requests += 1
+                path = self.path.split('?', 1)[0]
+                if path.endswith('robots.txt'):
+                    self._reply(200, "User-agent: *\nAllow: /\n", 'text/plain')
+                    return
+
+                parts = path.strip('/').split('/')
+                if len(parts) == 1:
+                    parts += ['page', '1']
+                if len(parts) != 3 or parts[1] != 'page' or not parts[2].isdigit():
+                    self._reply(404, "not found", 'text/plain')
+                    return
+
+                region, page = parts[0], int(parts[2])
+                if not 1 <= page <= server.pages:
+                    self._reply(404, "not found", 'text/plain')
+                    return
+                version = server.versions.get((region, page), 0)
+                self._reply(200, render_page(region, page, server.pages, server.cards, version), 'text/html')
+
+            def _reply(self, status, text, content_type):
+                body = text.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def region_url(self, region):
+        return f"{self.base_url}/{region}/page/1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Serve a synthetic business directory")
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--cards', type=int, default=25)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    with DirectoryServer(args.pages, args.cards, args.port) as server:
+        print(f"Serving synthetic directory on {server.base_url}")
+        while True:
+            time.sleep(3600)
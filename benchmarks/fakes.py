@@ -0,0 +1,485 @@
+import collections
+import itertools
+import queue
+import sys
+import threading
+import time
+import types
+import uuid
+from datetime import datetime
+
+# Local stand-ins for the external services the agents talk to.
+#
+# None of these touch the network. Each one can inject a fixed latency per
+# call so throughput numbers reflect realistic round-trips rather than dict
+# lookups.
+
+
+class _ServerTimestamp:
+    def __repr__(self):
+        return "SERVER_TIMESTAMP"
+
+
+SERVER_TIMESTAMP = _ServerTimestamp()
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+def _resolve(value, current=None):
+    if value is SERVER_TIMESTAMP:
+        return datetime.utcnow()
+    if isinstance(value, Increment):
+        return (current or 0) + value.value
+    return value
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentRef:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self._collection = collection
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def on_snapshot(self, callback):
+        return self._db._watch(self._collection, callback, self.id)
+
+    def get(self, transaction=None):
+        self._db._rpc('get', self.path)
+        if transaction is not None:
+            transaction._track(self)
+        return FakeSnapshot(self, self._db._docs(self._collection).get(self.id))
+
+    def set(self, data, merge=False):
+        self._db._rpc('set', self.path)
+        self._db._write(self._collection, self.id, data, merge)
+
+    def update(self, data):
+        self._db._rpc('update', self.path)
+        docs = self._db._docs(self._collection)
+        if self.id not in docs:
+            raise KeyError(f"No document to update: {self.path}")
+        self._db._write(self._collection, self.id, data, merge=True)
+
+    def delete(self):
+        self._db._rpc('delete', self.path)
+        self._db._delete(self._collection, self.id)
+
+
+_OPS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    'in': lambda a, b: a in b,
+    'array_contains': lambda a, b: b in (a or []),
+}
+
+
+class FakeQuery:
+    def __init__(self, db, collection, filters=(), limit=None):
+        self._db = db
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._limit = limit
+
+    def where(self, field, op, value):
+        return FakeQuery(self._db, self._collection, self._filters + ((field, op, value),), self._limit)
+
+    def limit(self, count):
+        return FakeQuery(self._db, self._collection, self._filters, count)
+
+    def _matches(self, data):
+        for field, op, value in self._filters:
+            if field not in data:
+                return False
+            try:
+                if not _OPS[op](data[field], value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def stream(self):
+        self._db._rpc('query', self._collection)
+        with self._db._lock:
+            items = list(self._db._docs(self._collection).items())
+        matched = (
+            FakeSnapshot(FakeDocumentRef(self._db, self._collection, doc_id), data)
+            for doc_id, data in items if self._matches(data)
+        )
+        return iter(list(itertools.islice(matched, self._limit)))
+
+    get = stream
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, name):
+        super().__init__(db, name)
+        self.id = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentRef(self._db, self._collection, doc_id or uuid.uuid4().hex)
+
+    def on_snapshot(self, callback):
+        return self._db._watch(self._collection, callback)
+
+
+class FakeWatch:
+    def __init__(self, db, collection, callback, doc_id=None):
+        self._db = db
+        self._collection = collection
+        self.callback = callback
+        self.doc_id = doc_id
+
+    def unsubscribe(self):
+        with self._db._lock:
+            self._db._watches[self._collection].remove(self)
+
+
+class TransactionConflict(Exception):
+    pass
+
+
+class FakeTransaction:
+    """Optimistic transaction: reads are versioned, writes apply at commit"""
+
+    def __init__(self, db):
+        self._db = db
+        self._reads = {}
+        self._writes = []
+
+    def _track(self, ref):
+        self._reads.setdefault(ref.path, self._db._versions.get(ref.path, 0))
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, data, merge))
+
+    def update(self, ref, data):
+        self._writes.append((ref, data, True))
+
+    def _commit(self):
+        self._db._rpc('commit', f"{len(self._writes)} writes")
+        self._db._throttle({ref.path for ref, _, _ in self._writes})
+        with self._db._lock:
+            for path, version in self._reads.items():
+                if self._db._versions.get(path, 0) != version:
+                    raise TransactionConflict(path)
+            for ref, data, merge in self._writes:
+                self._db._write(ref._collection, ref.id, data, merge)
+
+
+class FakeBatch:
+    """Write batch: applied atomically in one RPC at commit"""
+
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, data, merge))
+
+    def update(self, ref, data):
+        self._writes.append((ref, data, True))
+
+    def delete(self, ref):
+        self._writes.append((ref, None, False))
+
+    def commit(self):
+        self._db._rpc('commit', f"{len(self._writes)} writes")
+        with self._db._lock:
+            for ref, data, merge in self._writes:
+                if data is None:
+                    self._db._delete(ref._collection, ref.id)
+                else:
+                    self._db._write(ref._collection, ref.id, data, merge)
+        self._writes = []
+
+
+def transactional(func):
+    """Fake of firestore.transactional: retry the body on conflicting commits"""
+    def wrapper(transaction, *args, **kwargs):
+        for attempt in range(5):
+            result = func(transaction, *args, **kwargs)
+            try:
+                transaction._commit()
+                return result
+            except TransactionConflict:
+                transaction = FakeTransaction(transaction._db)
+        raise TransactionConflict("too much contention")
+    return wrapper
+
+
+class FakeFirestore:
+    """In-memory Firestore client with per-RPC latency injection
+
+    `listener`, if set, is called as listener(op, path) on every RPC so
+    benchmarks can mark operation boundaries. Snapshot listeners (on a
+    collection or a document) get each change `listen_latency` seconds after
+    the write, from a background thread as in the real client, and every
+    document they deliver counts as a 'listen' read. Transaction commits
+    writing a document wait until its last write is `doc_write_interval`
+    seconds old, standing in for Firestore's limit of about one write per
+    second per document.
+    """
+
+    def __init__(self, latency=0.0, listener=None, listen_latency=0.0, doc_write_interval=0.0):
+        self.latency = latency
+        self.listener = listener
+        self.listen_latency = listen_latency
+        self.doc_write_interval = doc_write_interval
+        self._write_slots = {}  # path -> when the document may next be written
+        self.calls = collections.Counter()
+        self._data = collections.defaultdict(dict)
+        self._versions = {}
+        self._lock = threading.RLock()
+        self._watches = collections.defaultdict(list)
+        self._events = None
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, refs, transaction=None):
+        """Batched read: one RPC for many documents"""
+        self._rpc('get_all', f"{len(refs)} documents")
+        for ref in refs:
+            if transaction is not None:
+                transaction._track(ref)
+            yield FakeSnapshot(ref, self._docs(ref._collection).get(ref.id))
+
+    def _docs(self, collection):
+        return self._data[collection]
+
+    def _throttle(self, paths):
+        if not self.doc_write_interval:
+            return
+        with self._lock:
+            now = time.perf_counter()
+            start = max([now] + [self._write_slots.get(path, 0) for path in paths])
+            for path in paths:
+                self._write_slots[path] = start + self.doc_write_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def _write(self, collection, doc_id, data, merge):
+        with self._lock:
+            path = f"{collection}/{doc_id}"
+            self._versions[path] = self._versions.get(path, 0) + 1
+            docs = self._docs(collection)
+            current = docs.get(doc_id, {}) if merge else {}
+            docs[doc_id] = {**current, **{key: _resolve(value, current.get(key)) for key, value in data.items()}}
+            self._notify(collection, [(doc_id, docs[doc_id], 'ADDED' if not current else 'MODIFIED')])
+
+    def _delete(self, collection, doc_id):
+        with self._lock:
+            if self._docs(collection).pop(doc_id, None) is not None:
+                self._notify(collection, [(doc_id, None, 'REMOVED')])
+
+    def _watch(self, collection, callback, doc_id=None):
+        """Collection listener, or a single-document one if doc_id is given"""
+        with self._lock:
+            watch = FakeWatch(self, collection, callback, doc_id)
+            self._watches[collection].append(watch)
+            # Like Firestore, a new listener first gets every document it covers
+            docs = self._docs(collection)
+            if doc_id is None:
+                initial = [(key, data, 'ADDED') for key, data in docs.items()]
+            else:
+                initial = [(doc_id, docs.get(doc_id), 'ADDED' if doc_id in docs else 'REMOVED')]
+            self._notify(collection, initial, [watch])
+        return watch
+
+    def _notify(self, collection, changes, watches=None):
+        # Caller holds self._lock
+        watches = list(watches or self._watches.get(collection, ()))
+        if not watches or not changes:
+            return
+        if self._events is None:
+            self._events = queue.Queue()
+            threading.Thread(target=self._deliver, name='fake-firestore-listen', daemon=True).start()
+        changes = [types.SimpleNamespace(
+            type=types.SimpleNamespace(name=kind),
+            document=FakeSnapshot(FakeDocumentRef(self, collection, doc_id), dict(data) if data else None),
+        ) for doc_id, data, kind in changes]
+        due = time.monotonic() + self.listen_latency
+        for watch in watches:
+            matched = [c for c in changes if watch.doc_id is None or c.document.id == watch.doc_id]
+            if matched:
+                self._events.put((due, watch, matched))
+
+    def _deliver(self):
+        while True:
+            due, watch, changes = self._events.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if watch not in self._watches[watch._collection]:
+                continue
+            # Snapshot listeners are billed one read per document delivered
+            with self._lock:
+                self.calls['listen'] += len(changes)
+            if self.listener:
+                self.listener('listen', f"{len(changes)} documents")
+            watch.callback([change.document for change in changes], changes, datetime.utcnow())
+
+    def _rpc(self, op, path):
+        with self._lock:
+            self.calls[op] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.listener:
+            self.listener(op, path)
+
+    def seed(self, collection, documents):
+        """Bulk-load {doc_id: data} without counting RPCs"""
+        with self._lock:
+            self._docs(collection).update(documents)
+
+
+class Sink:
+    """Thread-safe record of everything a fake client was asked to send"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.items = []
+        self._lock = threading.Lock()
+
+    def record(self, item):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.items.append(item)
+
+    def __len__(self):
+        return len(self.items)
+
+
+TELEGRAM = Sink()
+SENDGRID = Sink()
+
+
+class FakeBot:
+    def __init__(self, token=None):
+        self.token = token
+
+    def send_message(self, chat_id, text, **kwargs):
+        TELEGRAM.record({'chat_id': chat_id, 'text': text})
+
+    def get_webhook_info(self):
+        return types.SimpleNamespace(pending_update_count=0)
+
+
+class FakeMail:
+    def __init__(self, from_email=None, to_emails=None, subject=None, html_content=None):
+        self.from_email = from_email
+        self.to_emails = to_emails
+        self.subject = subject
+        self.html_content = html_content
+
+
+class FakeSendGridAPIClient:
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+
+    def send(self, message):
+        SENDGRID.record({'to': message.to_emails, 'subject': message.subject})
+        return types.SimpleNamespace(status_code=202)
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None, url=""):
+        self.status_code = status_code
+        self._payload = payload or {}
+        self.text = str(self._payload)
+        self.url = url
+
+    def json(self):
+        return self._payload
+
+
+class FakeHTTP:
+    """Stand-in for the `requests` module when posting to social platforms"""
+
+    def __init__(self, latency=0.0):
+        self.sink = Sink(latency)
+
+    def post(self, url, **kwargs):
+        self.sink.record(url)
+        if 'media/upload' in url:
+            return FakeResponse(200, {'media_id_string': str(len(self.sink))}, url)
+        if url.endswith('/tweets'):
+            return FakeResponse(201, {'data': {'id': str(len(self.sink))}}, url)
+        return FakeResponse(200, {'id': str(len(self.sink))}, url)
+
+    def get(self, url, **kwargs):
+        self.sink.record(url)
+        return FakeResponse(200, {}, url)
+
+
+def load_fake_nlu(latency=0.0, slow_latency=0.0, slow_marker='slow'):
+    """nlu_pool loader: CPU-bound stand-in for Rasa inference (spins, does not sleep)"""
+    def handle(text, sender_id):
+        deadline = time.perf_counter() + (slow_latency if slow_marker in text else latency)
+        while time.perf_counter() < deadline:
+            pass
+        return [{'recipient_id': sender_id, 'text': f"echo: {text}"}]
+
+    return handle
+
+
+def fail_fake_nlu():
+    """nlu_pool loader that cannot load its model"""
+    raise FileNotFoundError("models/rasa_model.tar.gz")
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def install_fake_modules(db=None):
+    """Point telegram, sendgrid and firebase_admin imports at the fakes
+
+    Benchmarks must never reach a real service, so these replace any real
+    packages that happen to be installed.
+    """
+    firestore = _module('firebase_admin.firestore', SERVER_TIMESTAMP=SERVER_TIMESTAMP,
+                        transactional=transactional, Increment=Increment, client=lambda app=None: db)
+    fakes = {
+        'telegram': _module('telegram', Bot=FakeBot),
+        'sendgrid': _module('sendgrid', SendGridAPIClient=FakeSendGridAPIClient),
+        'sendgrid.helpers': _module('sendgrid.helpers'),
+        'sendgrid.helpers.mail': _module('sendgrid.helpers.mail', Mail=FakeMail),
+        'firebase_admin': _module('firebase_admin', firestore=firestore),
+        'firebase_admin.firestore': firestore,
+    }
+    sys.modules.update(fakes)
+    return fakes
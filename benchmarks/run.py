@@ -0,0 +1,721 @@
+"""Offline agent benchmarks.
+
+    python -m benchmarks.run scrape reminders moderation posting --scale 500
+
+Every scenario runs against local fakes (see benchmarks/fakes.py) in its own
+interpreter so peak RSS is per scenario. Results are appended to
+benchmarks/results/<scenario>.json and compared with the previous run.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from . import fakes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+SCENARIOS = {}
+
+
+def scenario(func):
+    SCENARIOS[func.__name__] = func
+    return func
+
+
+class Recorder:
+    """Collects operation boundaries; latency is the gap between marks"""
+
+    def __init__(self):
+        self.marks = []
+        self.start = None
+
+    def begin(self):
+        self.start = time.perf_counter()
+        self.marks = []
+
+    def mark(self, *args):
+        self.marks.append(time.perf_counter())
+
+    def latencies(self):
+        edges = [self.start] + self.marks
+        return [b - a for a, b in zip(edges, edges[1:])]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _use_fake_db(args, listener=None):
+    from ai_agents import services
+
+    db = fakes.FakeFirestore(latency=args.db_latency / 1000.0, listener=listener)
+    services.provide('firestore', db)
+    fakes.install_fake_modules(db)
+    return db
+
+
+def _crawl_threads(path, run_id, base_urls, workers, planner=None):
+    """Drain a crawl frontier with thread workers (the fake database lives in this process)"""
+    import threading
+
+    from ai_agents import crawler, data_scraper
+
+    def work():
+        crawler.crawl_worker(crawler.get_frontier(run_id, path), crawler.HostThrottle(path),
+                             data_scraper.BusinessScraper(base_urls=base_urls), planner, idle_sleep=0.01)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+@scenario
+def scrape(args, recorder):
+    """Crawl the synthetic directory for every region through the checkpointed frontier"""
+    import tempfile
+
+    db = _use_fake_db(args)
+    from ai_agents import crawler, data_scraper
+    from .directory_server import DirectoryServer
+
+    pages = max(1, args.scale // args.cards)
+    with DirectoryServer(pages=pages, cards=args.cards) as server, tempfile.TemporaryDirectory() as tmp:
+        base_urls = {region: server.region_url(region) for region in data_scraper.REGIONS}
+        data_scraper.BusinessScraper.delay_range = (0, 0)
+
+        real_get = data_scraper.requests.get
+
+        def get(url, *a, **kw):
+            response = real_get(url, *a, **kw)
+            recorder.mark()
+            return response
+
+        path = os.path.join(tmp, 'crawl.sqlite3')
+        frontier = crawler.get_frontier('benchmark', path)
+        crawler.seed(frontier, base_urls, data_scraper.REGIONS)
+
+        data_scraper.requests.get = get
+        recorder.begin()
+        try:
+            _crawl_threads(path, 'benchmark', base_urls, args.workers)
+        finally:
+            data_scraper.requests.get = real_get
+        counts = frontier.stats()
+
+    return {'unit': 'page', 'pages_per_region': pages, 'workers': args.workers, 'frontier': counts,
+            'documents': len(db._docs('unclaimed_listings')), 'firestore_calls': dict(db.calls)}
+
+
+@scenario
+def recrawl(args, recorder):
+    """Nightly planned re-crawls of a directory where a few pages change often and most rarely"""
+    import random
+    import tempfile
+
+    db = _use_fake_db(args)
+    from ai_agents import crawler, data_scraper, recrawl as planning
+    from .directory_server import DirectoryServer
+
+    pages = max(1, args.scale // args.cards)
+    rng = random.Random(0)
+    # Nightly change probability per page: 10% hot, 20% warm, the rest stable
+    churn = {}
+    for region in data_scraper.REGIONS:
+        for page in range(1, pages + 1):
+            roll = rng.random()
+            churn[(region, page)] = 0.8 if roll < 0.1 else 0.1 if roll < 0.3 else 0.01
+
+    clock = [time.time()]
+    with DirectoryServer(pages=pages, cards=args.cards) as server, tempfile.TemporaryDirectory() as tmp:
+        base_urls = {region: server.region_url(region) for region in data_scraper.REGIONS}
+        data_scraper.BusinessScraper.delay_range = (0, 0)
+        path = os.path.join(tmp, 'crawl.sqlite3')
+        planner = planning.RecrawlPlanner(path, clock=lambda: clock[0])
+
+        saved = [0]
+        real_save = data_scraper.BusinessScraper.save_cards
+        real_get = data_scraper.requests.get
+
+        def save_cards(self, cards, url):
+            saved[0] += 1
+            return real_save(self, cards, url)
+
+        def get(url, *a, **kw):
+            response = real_get(url, *a, **kw)
+            if not url.endswith('robots.txt'):
+                recorder.mark()
+            return response
+
+        data_scraper.BusinessScraper.save_cards = save_cards
+        data_scraper.requests.get = get
+        changed_pages = 0
+        recorder.begin()
+        try:
+            for night in range(args.nights):
+                if night:
+                    clock[0] += planning.DAY
+                    for key, probability in churn.items():
+                        if rng.random() < probability:
+                            server.versions[key] = server.versions.get(key, 0) + 1
+                            changed_pages += 1
+                run_id = f"night-{night}"
+                crawler.seed(crawler.get_frontier(run_id, path), base_urls, data_scraper.REGIONS, planner)
+                _crawl_threads(path, run_id, base_urls, args.workers, planner)
+        finally:
+            data_scraper.BusinessScraper.save_cards = real_save
+            data_scraper.requests.get = real_get
+
+    full = len(churn) * args.nights
+    fetched = len(recorder.marks)
+    return {'unit': 'page', 'nights': args.nights, 'pages': len(churn), 'full_crawl_fetches': full,
+            'fetched': fetched, 'extracted': saved[0], 'changed_pages': changed_pages,
+            'fetch_ratio': round(fetched / full, 3), 'churn_ratio': round(changed_pages / full, 3),
+            'documents': len(db._docs('unclaimed_listings')), 'planner': planner.stats()}
+
+
+@scenario
+def reminders(args, recorder):
+    """Hourly renewal reminder run over listings expiring in the next 3 days"""
+    db = _use_fake_db(args)
+    from ai_agents import customer_support
+
+    now = time.time()
+    db.seed('users', {
+        f"user{i}": {'telegram_id': 1000 + i, 'email': f"owner{i}@example.co.za" if i % 2 else None}
+        for i in range(args.scale)
+    })
+    db.seed('listings', {
+        f"listing{i}": {'owner_id': f"user{i}", 'business_name': f"Business {i}",
+                        'tier': 'independent', 'expiry_date': now + 3600 + i}
+        for i in range(args.scale)
+    })
+    fakes.TELEGRAM.latency = fakes.SENDGRID.latency = args.sink_latency / 1000.0
+    # Every owner has a Telegram id, so one message marks one listing
+    send = fakes.TELEGRAM.record
+    fakes.TELEGRAM.record = lambda item: (send(item), recorder.mark())
+
+    recorder.begin()
+    customer_support.send_renewal_reminder(telegram_token='benchmark')
+    return {'unit': 'listing', 'telegram_sent': len(fakes.TELEGRAM), 'emails_sent': len(fakes.SENDGRID),
+            'firestore_calls': dict(db.calls)}
+
+
+class KeywordModerator:
+    """Model stand-in with a fixed per-call inference latency"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def moderate_content(self, text, threshold=0.7):
+        if self.latency:
+            time.sleep(self.latency)
+        return any(word in text.lower() for word in ("crypto", "forex", "xxx"))
+
+    def moderate_batch(self, texts, threshold=0.7, batch_size=256):
+        # One model call per batch, as ContentModerator.predict_batch makes
+        if self.latency:
+            time.sleep(self.latency * -(-len(texts) // batch_size))
+        return [any(word in text.lower() for word in ("crypto", "forex", "xxx")) for text in texts]
+
+
+@scenario
+def moderation(args, recorder):
+    """Daily moderation pass over new listings and reviews"""
+    db = _use_fake_db(args, listener=lambda op, path: op == 'update' and recorder.mark())
+    from ai_agents import training_model
+
+    created = datetime.utcnow()
+    half = args.scale // 2
+    db.seed('listings', {
+        f"listing{i}": {'business_name': f"Business {i}", 'moderated': False, 'created_at': created,
+                        'description': "Quick forex returns" if i % 50 == 0 else "Family run plumbing"}
+        for i in range(half)
+    })
+    db.seed('reviews', {
+        f"review{i}": {'content': "Great service" if i % 40 else "crypto xxx", 'moderated': False,
+                       'created_at': created}
+        for i in range(args.scale - half)
+    })
+
+    trainer = training_model.ModelTrainer.__new__(training_model.ModelTrainer)
+    if args.real_model:
+        trainer.moderator = training_model.ContentModerator()
+    else:
+        trainer.moderator = KeywordModerator(args.model_latency / 1000.0)
+
+    recorder.begin()
+    with contextlib.redirect_stdout(io.StringIO()):
+        trainer.daily_moderation()
+    return {'unit': 'item', 'real_model': args.real_model, 'firestore_calls': dict(db.calls)}
+
+
+@scenario
+def posting(args, recorder):
+    """Feature-and-post cycle across all social platforms"""
+    db = _use_fake_db(args)
+    from ai_agents import social_media_manager
+
+    stale = datetime.utcnow() - timedelta(days=30)
+    db.seed('listings', {
+        f"listing{i}": {'id': f"listing{i}", 'business_name': f"Business {i}", 'tier': 'independent',
+                        'last_featured': stale, 'town': "Bloemfontein", 'region': "Mangaung",
+                        'category': "Plumbers", 'address': "1 Main Road", 'phone': "+27511234567",
+                        'description': "Family run plumbing"}
+        for i in range(args.scale)
+    })
+
+    http = fakes.FakeHTTP(latency=args.sink_latency / 1000.0)
+    social_media_manager.requests = http
+    smm = social_media_manager.SocialMediaManager()
+    for platform in smm.platforms.values():
+        platform.update(access_token='benchmark', page_id='benchmark')
+
+    image_mode = 'rendered'
+    try:
+        smm.create_image(db._docs('listings')['listing0'])
+    except Exception:
+        # Fonts (or Pillow) missing on this host: post a placeholder image
+        image_mode = 'placeholder'
+        smm.create_image = lambda business: io.BytesIO(b'\x89PNG')
+
+    posts = max(1, args.scale // 10)
+    recorder.begin()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(posts):
+            text, image = smm.create_content()
+            smm.post_to_platforms(text, image)
+            recorder.mark()
+    return {'unit': 'post', 'image': image_mode, 'requests_sent': len(http.sink),
+            'firestore_calls': dict(db.calls)}
+
+
+@scenario
+def cache(args, recorder):
+    """A day of hourly agent runs plus the support bot, with and without the shared listing cache"""
+    import random
+
+    reads = {'documents': 0}
+
+    def count_reads(op, path):
+        if op == 'get':
+            reads['documents'] += 1
+        elif op in ('get_all', 'listen'):
+            reads['documents'] += int(path.split()[0])
+
+    db = _use_fake_db(args, listener=count_reads)
+    # Snapshot listener delivery delay
+    db.listen_latency = 0.05
+    from ai_agents import customer_support, listing_cache, social_media_manager, training_model
+
+    now = time.time()
+    stale = datetime.utcnow() - timedelta(days=30)
+    users = max(1, args.scale // 2)
+    db.seed('users', {f"user{i}": {'telegram_id': 1000 + i, 'email': f"owner{i}@example.co.za"}
+                      for i in range(users)})
+    db.seed('listings', {
+        f"listing{i}": {'owner_id': f"user{i % users}", 'business_name': f"Business {i}",
+                        'tier': ('free', 'independent', 'large_business')[i % 3],
+                        # One listing in ten expires within three days
+                        'expiry_date': now + (3600 if i % 10 == 0 else 30 * 86400) + i,
+                        'last_featured': stale, 'town': "Bloemfontein", 'region': "Mangaung",
+                        'category': "Plumbers", 'address': "1 Main Road", 'phone': "+27511234567",
+                        'moderated': i % 5 != 0, 'created_at': datetime.utcnow()}
+        for i in range(args.scale)
+    })
+    renewing = [f"user{i % users}" for i in range(0, args.scale, 10)]
+
+    agent = customer_support.CustomerSupportAgent.__new__(customer_support.CustomerSupportAgent)
+    agent.telegram_token = 'benchmark'
+    trainer = training_model.ModelTrainer.__new__(training_model.ModelTrainer)
+    trainer.moderator = KeywordModerator(0)
+    smm = social_media_manager.SocialMediaManager()
+
+    def run_day(new_cache, bot_cache, rng):
+        """24 hourly agent processes, each with a fresh cache, and one long-running bot"""
+        hour = [0]
+        bot_cache.clock = lambda: hour[0] * 3600
+        with contextlib.redirect_stdout(io.StringIO()):
+            for hour[0] in range(24):
+                listing_cache._cache = new_cache()
+                if hour[0] == 0:
+                    trainer.daily_moderation()
+                customer_support.send_renewal_reminder(telegram_token='benchmark')
+                recorder.mark()
+                if hour[0] % 4 == 0:
+                    smm.get_featured_business()
+                    recorder.mark()
+
+                # Owners reminded about expiring listings come to the bot to renew
+                listing_cache._cache = bot_cache
+                for _ in range(max(1, args.scale // 50)):
+                    agent.handle_renewal_request(rng.choice(renewing))
+                    recorder.mark()
+                    agent.generate_payment_link(rng.choice(renewing), f"listing{rng.randrange(0, args.scale, 10)}")
+                    recorder.mark()
+
+    # Baseline: caches that keep nothing, so every lookup is a database read
+    run_day(lambda: listing_cache.ListingCache(db, max_entries=0), listing_cache.ListingCache(db, max_entries=0),
+            random.Random(7))
+    uncached = reads['documents']
+
+    reads['documents'] = 0
+    # A watched set smaller than the bot's working set, so the cap is exercised
+    bot_cache = listing_cache.ListingCache(db, max_watched=max(5, args.scale // 40)).watch()
+    recorder.begin()
+    run_day(lambda: listing_cache.ListingCache(db), bot_cache, random.Random(7))
+    time.sleep(db.listen_latency * 2)  # let listener snapshots land and be counted
+    cached = reads['documents']
+    listeners = sum(len(watches) for watches in db._watches.values())
+    if listeners > bot_cache.max_watched:
+        raise SystemExit(f"bot cache holds {listeners} listeners, cap is {bot_cache.max_watched}")
+
+    # Freshness: how long a write from elsewhere takes to reach the bot's cached records
+    lags = []
+    for i in range(0, args.scale, max(10, args.scale // 20 // 10 * 10)):
+        doc_id = f"listing{i}"
+        # Re-read so the document is in the watched set
+        bot_cache.invalidate('listings', doc_id)
+        bot_cache.get('listings', doc_id)
+        time.sleep(db.listen_latency * 2)
+        written = time.perf_counter()
+        db.collection('listings').document(doc_id).update({'tier': 'large_business', 'business_name': f"Renamed {i}"})
+        while bot_cache.get('listings', doc_id)['business_name'] != f"Renamed {i}":
+            time.sleep(0.001)
+        lags.append(time.perf_counter() - written)
+    stats = bot_cache.stats()
+    bot_cache.close()
+
+    return {'unit': 'lookup', 'document_reads_uncached': uncached, 'document_reads_cached': cached,
+            'read_reduction': round(1 - cached / uncached, 3) if uncached else None,
+            'max_staleness_ms': round(max(lags) * 1000, 1), 'listeners': listeners, 'bot_cache': stats}
+
+
+@scenario
+def nlu(args, recorder):
+    """Support-bot NLU on the worker pool: many senders, one message in 50 is slow"""
+    from concurrent.futures import ThreadPoolExecutor
+    from ai_agents import nlu_pool
+
+    # A model that will not load must fail start() after a bounded number of restarts
+    broken = nlu_pool.NLUPool(workers=1, loader=fakes.fail_fake_nlu, restart_backoff=0.05, max_start_restarts=3)
+    started = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            broken.start(timeout=60)
+    except nlu_pool.StartupFailed as e:
+        if 'FileNotFoundError' not in str(e) or broken.restarts != 3:
+            raise SystemExit(f"broken NLU model: {broken.restarts} restarts, {e}")
+    else:
+        raise SystemExit("NLU pool started with a loader that always fails")
+    startup_failure_seconds = time.perf_counter() - started
+
+    latency = args.model_latency / 1000.0
+    pool = nlu_pool.NLUPool(workers=args.workers, loader=fakes.load_fake_nlu, loader_args=(latency, latency * 50),
+                            max_pending=args.scale).start(timeout=120)
+    senders = max(1, args.scale // 5)
+    messages = [(f"user{i % senders}", "slow question" if i % 50 == 49 else f"message {i}")
+                for i in range(args.scale)]
+    fast, slow = [], []
+
+    def send(message):
+        started = time.perf_counter()
+        pool.ask(*message)
+        (slow if 'slow' in message[1] else fast).append(time.perf_counter() - started)
+        recorder.mark()
+
+    recorder.begin()
+    try:
+        with ThreadPoolExecutor(max_workers=32) as clients:
+            list(clients.map(send, messages))
+    finally:
+        pool.stop()
+
+    return {'unit': 'message', 'workers': pool.size, 'senders': senders,
+            'fast_p95_ms': round(_percentile(fast, 95) * 1000, 3),
+            'slow_p95_ms': round(_percentile(slow, 95) * 1000, 3), 'restarts': pool.restarts,
+            'startup_failure_seconds': round(startup_failure_seconds, 2)}
+
+
+def _keras_text():
+    """Keras Tokenizer and pad_sequences, from TensorFlow or standalone keras_preprocessing"""
+    try:
+        from tensorflow.keras.preprocessing.sequence import pad_sequences
+        from tensorflow.keras.preprocessing.text import Tokenizer
+    except ImportError:
+        try:
+            from keras_preprocessing.sequence import pad_sequences
+            from keras_preprocessing.text import Tokenizer
+        except ImportError:
+            return None, None
+    return Tokenizer, pad_sequences
+
+
+@scenario
+def tokenizer(args, recorder):
+    """Moderation text encoding: compact tokenizer vs the pickled Keras tokenizer"""
+    import pickle
+    import random
+    import tempfile
+    import tracemalloc
+
+    from ai_agents.tokenizer import CompactTokenizer
+
+    max_len, vocab_size, batch = 100, 10000, 256
+    rng = random.Random(0)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 10)))
+             for _ in range(50000)]
+    # Zipf-ish word use, listing-description lengths
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    texts = [' '.join(rng.choices(words, weights, k=rng.randint(5, 150))) + '!' for _ in range(args.scale * 10)]
+
+    def loaded(load):
+        tracemalloc.start()
+        obj = load()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return obj, round(size / 1024.0 / 1024.0, 2)
+
+    def timed(encode):
+        started = time.perf_counter()
+        for start in range(0, len(texts), batch):
+            encode(texts[start:start + batch])
+        return round(len(texts) / (time.perf_counter() - started), 1)
+
+    result = {'unit': 'batch', 'texts': len(texts), 'batch': batch}
+    with tempfile.TemporaryDirectory() as tmp:
+        compact_path = os.path.join(tmp, 'tokenizer.bin')
+        CompactTokenizer(max_len, vocab_size).fit_on_texts(texts).save(compact_path)
+        compact, result['compact_loaded_mb'] = loaded(lambda: CompactTokenizer.load(compact_path))
+        result['compact_file_kb'] = round(os.path.getsize(compact_path) / 1024.0, 1)
+
+        Tokenizer, pad_sequences = _keras_text()
+        if Tokenizer is not None:
+            keras_path = os.path.join(tmp, 'tokenizer.pkl')
+            fitted = Tokenizer(num_words=vocab_size)
+            fitted.fit_on_texts(texts)
+            with open(keras_path, 'wb') as f:
+                pickle.dump(fitted, f)
+            result['keras_file_kb'] = round(os.path.getsize(keras_path) / 1024.0, 1)
+
+            def load_pickle():
+                with open(keras_path, 'rb') as f:
+                    return pickle.load(f)
+
+            keras, result['keras_loaded_mb'] = loaded(load_pickle)
+            result['keras_texts_per_sec'] = timed(
+                lambda chunk: pad_sequences(keras.texts_to_sequences(chunk), maxlen=max_len))
+            result['matches_keras'] = bool(
+                (compact.encode(texts[:batch]) == pad_sequences(keras.texts_to_sequences(texts[:batch]),
+                                                                 maxlen=max_len)).all())
+
+    buffer = compact.encode(texts[:batch])
+    recorder.begin()
+    for start in range(0, len(texts), batch):
+        compact.encode(texts[start:start + batch], out=buffer)
+        recorder.mark()
+    result['compact_texts_per_sec'] = round(len(texts) / (recorder.marks[-1] - recorder.start), 1)
+    return result
+
+
+@scenario
+def webhooks(args, recorder):
+    """Renewal-day spike: replay PayFast ITNs (with retries) through ack, queue and workers"""
+    import random
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    db = _use_fake_db(args)
+    # Firestore's ~1 write/s per document, scaled down like the RPC latency
+    db.doc_write_interval = args.db_latency / 1000.0 * 5
+    from ai_agents import payment_handler
+    from ai_agents.work_queue import WorkQueue
+
+    listings = max(1, args.scale // 4)
+    db.seed('listings', {
+        f"listing{i}": {'owner_id': f"user{i}", 'tier': 'free', 'expiry_date': 0} for i in range(listings)
+    })
+    payments = [
+        {'pf_payment_id': f"pf{i}", 'payment_status': 'COMPLETE', 'amount_gross': '300.00',
+         'item_name': f"Listing Renewal - Business {i % listings}", 'custom_int1': f"user{i % listings}",
+         'custom_str1': f"listing{i % listings}"}
+        for i in range(args.scale)
+    ]
+    # Links created before listings were passed through only carry the payer
+    for payment in payments[::5]:
+        del payment['custom_str1']
+    # A malformed ITN must be parked on its own, not take its batch down
+    broken = {'pf_payment_id': 'pf-broken', 'payment_status': 'COMPLETE', 'amount_gross': 'R300'}
+    # PayFast retries roughly a quarter of notifications, some more than once
+    rng = random.Random(42)
+    deliveries = payments + [broken] + [rng.choice(payments) for _ in range(args.scale // 4 * 2)]
+    rng.shuffle(deliveries)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = WorkQueue(os.path.join(tmp, 'webhooks.sqlite3'), name='payfast_webhooks')
+        payment_handler._queue = queue
+        pool = payment_handler.WebhookWorkerPool(workers=args.workers, queue=queue, db=db, idle_sleep=0.01)
+
+        def deliver(data):
+            payment_handler.handle_webhook(data)
+            recorder.mark()
+
+        started_at = time.time()
+        recorder.begin()
+        pool.start()
+        with ThreadPoolExecutor(max_workers=32) as senders:
+            list(senders.map(deliver, deliveries))
+        acked = time.perf_counter()
+        pool.drain()
+        drained = time.perf_counter()
+        pool.stop()
+        stats = queue.stats()
+        queue.close()
+
+    # Every payment applied exactly once, and every renewal extended its listing once
+    recorded = len(db._docs('transactions'))
+    expected_expiry = {}
+    for payment in payments:
+        listing_id = payment['custom_int1'].replace('user', 'listing')
+        expected_expiry[listing_id] = expected_expiry.get(listing_id, 0) + 1
+    wrong = [lid for lid, count in expected_expiry.items()
+             if not started_at <= db._docs('listings')[lid]['expiry_date']
+             - count * payment_handler.RENEWAL_PERIOD <= time.time()]
+    if recorded != len(payments) or wrong or stats['dead'] != 1:
+        raise SystemExit(f"webhook replay mismatch: {recorded}/{len(payments)} recorded, "
+                         f"{len(wrong)} listings wrong, {stats['dead']} dead events")
+
+    # Incremental rollups must agree with a from-scratch rebuild
+    from ai_agents import revenue
+
+    rollup_ids = {doc_id.split('#')[0] for doc_id in db._docs(revenue.ROLLUP_COLLECTION)}
+    incremental = {rollup_id: revenue.get_rollup(rollup_id, db) for rollup_id in rollup_ids}
+    with contextlib.redirect_stdout(io.StringIO()):
+        revenue.rebuild(db)
+    rebuilt = {rollup_id: revenue.get_rollup(rollup_id, db) for rollup_id in rollup_ids}
+    total = sum(revenue.to_decimal(p['amount_gross']) for p in payments)
+    if incremental != rebuilt or revenue.get_rollup('all', db)['amount'] != total:
+        raise SystemExit("revenue rollups disagree with a rebuild from transactions")
+
+    return {'unit': 'webhook', 'deliveries': len(deliveries), 'unique_payments': len(payments),
+            'workers': args.workers, 'ack_seconds': round(acked - recorder.start, 4),
+            'apply_seconds': round(drained - recorder.start, 4),
+            'applied_per_sec': round(len(payments) / (drained - recorder.start), 2),
+            'queue': stats, 'firestore_calls': dict(db.calls)}
+
+
+def _git_rev():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_scenario(name, args):
+    recorder = Recorder()
+    extra = SCENARIOS[name](args, recorder)
+    elapsed = time.perf_counter() - recorder.start
+    latencies = recorder.latencies()
+    ops = len(latencies)
+
+    return {
+        'scenario': name,
+        'git_rev': _git_rev(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'params': {'scale': args.scale, 'db_latency_ms': args.db_latency,
+                   'sink_latency_ms': args.sink_latency, 'model_latency_ms': args.model_latency,
+                   'workers': args.workers, 'nights': args.nights},
+        'ops': ops,
+        'seconds': round(elapsed, 4),
+        'ops_per_sec': round(ops / elapsed, 2) if elapsed else None,
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 3),
+        # ru_maxrss is KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        **extra,
+    }
+
+
+def save_result(result):
+    """Append to results/<scenario>.json; return the previous entry, if any"""
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{result['scenario']}.json")
+    history = []
+    if os.path.exists(path):
+        with open(path) as f:
+            history = json.load(f)
+    previous = history[-1] if history else None
+    history.append(result)
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2, default=str)
+    return previous
+
+
+def report(result, previous):
+    line = (f"{result['scenario']:<12} {result['ops']:>7} {result['unit']}s  "
+            f"{result['ops_per_sec']:>10} ops/s  p50 {result['p50_ms']:>8} ms  "
+            f"p95 {result['p95_ms']:>8} ms  rss {result['peak_rss_mb']} MB")
+    print(line)
+    if previous and previous.get('ops_per_sec') and previous.get('params') == result['params']:
+        change = (result['ops_per_sec'] - previous['ops_per_sec']) / previous['ops_per_sec'] * 100
+        print(f"{'':<12} vs {previous.get('git_rev')}: {change:+.1f}% ops/s, "
+              f"p95 {previous['p95_ms']} -> {result['p95_ms']} ms")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run offline agent benchmarks")
+    parser.add_argument('scenarios', nargs='*', default=list(SCENARIOS), help=", ".join(SCENARIOS))
+    parser.add_argument('--scale', type=int, default=500, help="Items per scenario")
+    parser.add_argument('--cards', type=int, default=25, help="Business cards per directory page")
+    parser.add_argument('--db-latency', type=float, default=2.0, help="Injected Firestore RPC latency (ms)")
+    parser.add_argument('--sink-latency', type=float, default=5.0, help="Injected Telegram/SendGrid/HTTP latency (ms)")
+    parser.add_argument('--model-latency', type=float, default=1.0, help="Fake moderation inference latency (ms)")
+    parser.add_argument('--workers', type=int, default=16, help="Worker threads (webhooks, scrape) or processes (nlu)")
+    parser.add_argument('--nights', type=int, default=14, help="Simulated nights (recrawl)")
+    parser.add_argument('--real-model', action='store_true', help="Use the TensorFlow moderator")
+    parser.add_argument('--no-save', action='store_true', help="Do not append to results/")
+    parser.add_argument('--in-process', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+
+    if args.in_process:
+        for name in args.scenarios:
+            result = run_scenario(name, args)
+            previous = None if args.no_save else save_result(result)
+            report(result, previous)
+        return
+
+    # One interpreter per scenario keeps peak RSS and module state separate
+    options = [a for a in argv if a not in SCENARIOS]
+    failed = False
+    for name in args.scenarios:
+        proc = subprocess.run([sys.executable, '-m', 'benchmarks.run', name, '--in-process'] + options, cwd=ROOT)
+        failed = failed or proc.returncode != 0
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
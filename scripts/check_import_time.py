@@ -0,0 +1,100 @@
+"""Import-time budget check for the AI agents.
+
+Runs each agent module under `python -X importtime` in a fresh interpreter and
+fails if importing it takes longer than its budget or drags in a heavy
+dependency (TensorFlow, Rasa, diffusers, ...) that should only load on use.
+
+    python scripts/check_import_time.py
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module -> import budget in milliseconds
+BUDGETS = {
+    'ai_agents.services': 50,
+    'ai_agents.metrics': 50,
+    'ai_agents.work_queue': 50,
+    'ai_agents.crawler': 50,
+    'ai_agents.recrawl': 50,
+    'ai_agents.nlu_pool': 100,
+    'ai_agents.tokenizer': 50,
+    'ai_agents.listing_cache': 50,
+    'ai_agents.revenue': 50,
+    'ai_agents.search_index': 50,
+    'ai_agents.agent_orchestrator': 250,
+    'ai_agents.customer_support': 100,
+    'ai_agents.content_moderator': 100,
+    'ai_agents.training_model': 100,
+    'ai_agents.image_generator': 100,
+    'ai_agents.image_derivatives': 100,
+    'ai_agents.payment_handler': 400,
+    'ai_agents.social_media_manager': 400,
+    'ai_agents.data_scraper': 600,
+}
+
+# Nothing may pull these in just by being imported
+HEAVY_MODULES = [
+    'tensorflow', 'torch', 'diffusers', 'rasa', 'telegram', 'sklearn',
+    'firebase_admin', 'google.cloud', 'sendgrid', 'PIL',
+]
+
+PROBE = (
+    "import json, sys\n"
+    "__import__(sys.argv[1])\n"
+    "print(json.dumps(sorted(sys.modules)))\n"
+)
+
+
+def measure(module):
+    """Return (cumulative import time in ms, loaded module names)"""
+    import json
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE, module],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    cumulative_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line.split(':', 1)[1].split('|')]
+        if name == module:
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000.0, json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check agent import-time budgets")
+    parser.add_argument('modules', nargs='*', default=list(BUDGETS))
+    args = parser.parse_args()
+
+    failures = 0
+    for module in args.modules:
+        budget = BUDGETS.get(module, 100)
+        try:
+            elapsed, loaded = measure(module)
+        except RuntimeError as e:
+            print(f"⚠️ {module}: could not import ({e})")
+            failures += 1
+            continue
+
+        heavy = [m for m in HEAVY_MODULES if m in loaded]
+        status = "✅" if elapsed <= budget and not heavy else "❌"
+        print(f"{status} {module}: {elapsed:.1f} ms (budget {budget} ms)")
+        if heavy:
+            print(f"   eagerly imported: {', '.join(heavy)}")
+        if status == "❌":
+            failures += 1
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,45 @@
-import requests
+"""Download town and category images from Unsplash.
+
+    python scripts/download_images.py [--workers 8] [--force] [--only towns]
+
+Runs are restartable: finished images are recorded in a manifest with their
+SHA-256 and skipped next time, interrupted downloads resume the same photo
+from their .part file, and a photo returned for two different queries is
+fetched once and hard-linked. The script slows down as the Unsplash hourly
+quota runs low and stops cleanly when it is exhausted; just run it again
+later.
+"""
+import argparse
+import hashlib
+import json
 import os
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # List of towns in Free State by area
 towns = [
     # Mangaung
     "Bloemfontein", "Botshabelo", "Thaba Nchu",
     # Xhariep
-    "Trompsburg", "Philippolis", "Reddersburg",
-    # ... add more
+    "Trompsburg", "Philippolis", "Reddersburg", "Jagersfontein", "Fauresmith",
+    "Koffiefontein", "Jacobsdal", "Edenburg", "Smithfield", "Zastron", "Rouxville",
+    "Wepener", "Dewetsdorp",
+    # Lejweleputswa
+    "Welkom", "Virginia", "Odendaalsrus", "Bothaville", "Hoopstad", "Bultfontein",
+    "Wesselsbron", "Theunissen", "Brandfort", "Winburg",
+    # Thabo Mofutsanyana
+    "Bethlehem", "Harrismith", "Phuthaditjhaba", "Ficksburg", "Senekal", "Clarens",
+    "Reitz", "Fouriesburg", "Marquard", "Paul Roux", "Rosendal", "Kestell", "Warden",
+    "Clocolan",
+    # Fezile Dabi
+    "Sasolburg", "Kroonstad", "Parys", "Heilbron", "Frankfort", "Vredefort", "Koppies",
+    "Viljoenskroon", "Edenville", "Villiers",
 ]
 
 # Categories for which we need images
@@ -16,40 +47,258 @@ categories = [
     "Estate Agents", "Plumbers", "Electricians", "Auto Electricians", "Repair Shops"
 ]
 
-# Create directories
-os.makedirs("frontend/src/assets/towns", exist_ok=True)
-os.makedirs("frontend/src/assets/categories", exist_ok=True)
+TOWNS_DIR = "frontend/src/assets/towns"
+CATEGORIES_DIR = "frontend/src/assets/categories"
+MANIFEST_PATH = "frontend/src/assets/image_manifest.json"
 
 # Unsplash API access key (sign up for free and get one)
-ACCESS_KEY = "YOUR_UNSPLASH_ACCESS_KEY"
+ACCESS_KEY = os.getenv("UNSPLASH_ACCESS_KEY", "YOUR_UNSPLASH_ACCESS_KEY")
+API_URL = "https://api.unsplash.com/photos/random"
 
-def download_image(query, save_path):
-    url = "https://api.unsplash.com/photos/random"
-    params = {
-        "query": query,
-        "client_id": ACCESS_KEY
-    }
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        data = response.json()
-        image_url = data['urls']['regular']
-        image_response = requests.get(image_url, stream=True)
-        if image_response.status_code == 200:
-            with open(save_path, 'wb') as f:
-                image_response.raw.decode_content = True
-                shutil.copyfileobj(image_response.raw, f)
-                print(f"Downloaded {query} image to {save_path}")
+CHUNK_SIZE = 64 * 1024
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+class RateLimiter:
+    """Tracks Unsplash's X-Ratelimit-Remaining and paces API calls to fit it
+
+    While plenty of quota is left calls go straight through; once it drops
+    below `reserve` each call waits long enough to spread what is left over
+    the rest of the hour. At zero it raises QuotaExhausted.
+    """
+
+    def __init__(self, reserve=5, window=3600):
+        self.reserve = reserve
+        self.window = window
+        self.remaining = None
+        self._lock = threading.Lock()
+        self._next_call = 0.0
+
+    def acquire(self):
+        with self._lock:
+            if self.remaining is not None and self.remaining <= 0:
+                raise QuotaExhausted("Unsplash hourly quota used up")
+            delay = max(0.0, self._next_call - time.monotonic())
+            if self.remaining is not None and self.remaining < self.reserve:
+                self._next_call = time.monotonic() + delay + self.window / max(self.remaining, 1)
+            if self.remaining is not None:
+                self.remaining -= 1
+        if delay:
+            time.sleep(delay)
+
+    def update(self, response):
+        remaining = response.headers.get("X-Ratelimit-Remaining")
+        with self._lock:
+            if remaining is not None and remaining.isdigit():
+                self.remaining = int(remaining)
+            if response.status_code in (403, 429) and self.remaining == 0:
+                raise QuotaExhausted("Unsplash hourly quota used up")
+
+
+class Manifest:
+    """Thread-safe record of finished downloads, saved after every change"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_current(self, save_path):
+        entry = self.entries.get(save_path)
+        return bool(entry) and os.path.exists(save_path) and sha256_file(save_path) == entry["sha256"]
+
+    def find_photo(self, photo_id):
+        with self._lock:
+            for save_path, entry in self.entries.items():
+                if entry.get("photo_id") == photo_id and os.path.exists(save_path):
+                    return save_path, entry
+        return None, None
+
+    def find_hash(self, digest, exclude):
+        with self._lock:
+            for save_path, entry in self.entries.items():
+                if save_path != exclude and entry["sha256"] == digest and os.path.exists(save_path):
+                    return save_path
+        return None
+
+    def record(self, save_path, entry):
+        with self._lock:
+            self.entries[save_path] = entry
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_session(pool_size):
+    """Shared keep-alive session with retries on transient errors"""
+    session = requests.Session()
+    retry = Retry(total=4, backoff_factor=1, status_forcelist=(500, 502, 503, 504),
+                  allowed_methods=("GET",))
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def link_or_copy(source, target):
+    """Hard-link target to an identical existing file, copying across filesystems"""
+    tmp_path = f"{target}.link"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def fetch_file(session, url, save_path):
+    """Stream url into save_path, resuming from save_path.part if present"""
+    part_path = f"{save_path}.part"
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with session.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+        if response.status_code == 416:
+            # .part already holds the whole file
+            pass
+        elif response.status_code in (200, 206):
+            mode = "ab" if response.status_code == 206 else "wb"
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
         else:
-            print(f"Failed to download image for {query}")
-    else:
-        print(f"Failed to get image for {query}: {response.status_code}")
-
-# Download town images
-for town in towns:
-    save_path = f"frontend/src/assets/towns/{town.replace(' ', '_').lower()}.jpg"
-    download_image(f"{town} Free State South Africa", save_path)
-
-# Download category images
-for category in categories:
-    save_path = f"frontend/src/assets/categories/{category.replace(' ', '_').lower()}.jpg"
-    download_image(f"{category} service Free State South Africa", save_path)
+            raise IOError(f"HTTP {response.status_code}")
+
+    os.replace(part_path, save_path)
+
+
+def download_image(query, save_path, session, limiter, manifest, force=False):
+    """Fetch one image; returns 'skipped', 'linked' or 'downloaded'"""
+    if not force and manifest.is_current(save_path):
+        return "skipped"
+
+    # An interrupted run left a partial file: finish that photo, not a new random one
+    pending_path = f"{save_path}.pending"
+    try:
+        with open(pending_path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = None
+        if os.path.exists(f"{save_path}.part"):
+            os.remove(f"{save_path}.part")
+
+    if data is None:
+        limiter.acquire()
+        response = session.get(API_URL, params={"query": query, "client_id": ACCESS_KEY}, timeout=(10, 30))
+        limiter.update(response)
+        if response.status_code != 200:
+            raise IOError(f"Failed to get image for {query}: {response.status_code}")
+        data = response.json()
+
+    photo_id = data.get("id")
+
+    # Same photo already on disk for another query: link it instead
+    existing_path, existing = manifest.find_photo(photo_id) if photo_id else (None, None)
+    if existing_path and existing_path != save_path:
+        link_or_copy(existing_path, save_path)
+        manifest.record(save_path, {**existing, "query": query})
+        # A resumed photo may have left these; the manifest now says the path is done
+        for leftover in (pending_path, f"{save_path}.part"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        return "linked"
+
+    with open(pending_path, "w") as f:
+        json.dump({"id": photo_id, "urls": {"regular": data["urls"]["regular"]}}, f)
+    fetch_file(session, data["urls"]["regular"], save_path)
+    os.remove(pending_path)
+    digest = sha256_file(save_path)
+
+    # Identical bytes under a different photo id: share one copy on disk
+    duplicate = manifest.find_hash(digest, exclude=save_path)
+    if duplicate:
+        link_or_copy(duplicate, save_path)
+
+    manifest.record(save_path, {
+        "query": query,
+        "photo_id": photo_id,
+        "sha256": digest,
+        "bytes": os.path.getsize(save_path),
+    })
+    return "linked" if duplicate else "downloaded"
+
+
+def build_jobs(only=None):
+    jobs = []
+    if only in (None, "towns"):
+        for town in towns:
+            save_path = f"{TOWNS_DIR}/{town.replace(' ', '_').lower()}.jpg"
+            jobs.append((f"{town} Free State South Africa", save_path))
+    if only in (None, "categories"):
+        for category in categories:
+            save_path = f"{CATEGORIES_DIR}/{category.replace(' ', '_').lower()}.jpg"
+            jobs.append((f"{category} service Free State South Africa", save_path))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download town and category images")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--force", action="store_true", help="Re-download even if the manifest is current")
+    parser.add_argument("--only", choices=["towns", "categories"])
+    args = parser.parse_args()
+
+    # Create directories
+    os.makedirs(TOWNS_DIR, exist_ok=True)
+    os.makedirs(CATEGORIES_DIR, exist_ok=True)
+
+    manifest = Manifest(MANIFEST_PATH)
+    limiter = RateLimiter()
+    session = make_session(args.workers)
+    jobs = build_jobs(args.only)
+    results = {"skipped": 0, "linked": 0, "downloaded": 0, "failed": 0}
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(download_image, query, save_path, session, limiter, manifest, args.force): (query, save_path)
+            for query, save_path in jobs
+        }
+        for future in as_completed(futures):
+            query, save_path = futures[future]
+            try:
+                outcome = future.result()
+            except QuotaExhausted:
+                results["failed"] += 1
+                continue
+            except Exception as e:
+                print(f"Failed to download image for {query}: {e}")
+                results["failed"] += 1
+                continue
+            results[outcome] += 1
+            if outcome != "skipped":
+                print(f"{outcome.capitalize()} {query} image to {save_path}")
+
+    if limiter.remaining == 0:
+        print("⚠️ Unsplash quota exhausted; run again after the hourly reset to finish")
+    print(", ".join(f"{count} {name}" for name, count in results.items()))
+
+
+if __name__ == "__main__":
+    main()